@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+per player statistics of many packet logs
+
+Every log file is replayed in a worker process of a pool (text logs with the
+replay.py parser, binary logs with binlog.py) into a headless protocol whose
+table counts the actions of the players. The statistics of the files are
+merged at the end.
+
+    python analytics.py <log file or directory> ... [--processes n] [--min-hands n]
+"""
+import sys, time, multiprocessing
+from pokerpackets import networkpackets
+
+from explain import Table, GAME_STATE_PRE_FLOP
+from dispatch import handles
+from handindex import iterLogFiles
+from replayengine import ReplayEngine, HeadlessProtocol
+
+
+class PlayerStats(object):
+    """counters of a player, the counters of several logs can be merged"""
+
+    def __init__(self):
+        self.hands = 0
+        # hands the player put money in the pot preflop voluntarily / raised preflop
+        self.vpip = 0
+        self.pfr = 0
+        # bets and raises / calls of all betting rounds
+        self.raises = 0
+        self.calls = 0
+        self.showdowns = 0
+        self.showdowns_won = 0
+
+    def merge(self, other):
+        """add the counters of other"""
+        for name, value in other.__dict__.iteritems():
+            setattr(self, name, getattr(self, name) + value)
+
+    def vpipRate(self):
+        return float(self.vpip) / self.hands if self.hands else 0.0
+
+    def pfrRate(self):
+        return float(self.pfr) / self.hands if self.hands else 0.0
+
+    def aggressionFactor(self):
+        """returns (bets + raises) / calls, None if the player never called"""
+        return float(self.raises) / self.calls if self.calls else None
+
+    def showdownWinRate(self):
+        return float(self.showdowns_won) / self.showdowns if self.showdowns else 0.0
+
+
+class StatsTable(Table):
+    """table that counts the actions of the players in protocol.stats"""
+
+    def __init__(self, protocol, avatar, table_info):
+        Table.__init__(self, protocol, avatar, table_info)
+        self._in_hand = None
+
+    def _stats(self, serial):
+        stats = self.protocol.stats.get(serial)
+        if stats is None:
+            stats = self.protocol.stats[serial] = PlayerStats()
+        return stats
+
+    def _startHand(self, players):
+        self._finishHand()
+        self._in_hand = list(players)
+        self._voluntary = set()
+        self._raised = set()
+        self._folded = set()
+
+    def _finishHand(self, winners=None):
+        """count the hand, winners is None if the hand did not end (e.g. the log stopped)"""
+        if self._in_hand is None:
+            return
+        for serial in self._in_hand:
+            stats = self._stats(serial)
+            stats.hands += 1
+            stats.vpip += serial in self._voluntary
+            stats.pfr += serial in self._raised
+        showdown = [serial for serial in self._in_hand if serial not in self._folded]
+        if winners is not None and len(showdown) > 1:
+            for serial in showdown:
+                stats = self._stats(serial)
+                stats.showdowns += 1
+                stats.showdowns_won += serial in winners
+        self._in_hand = None
+
+    # the first PacketPokerStart is handled by the protocol, PacketPokerInGame starts every hand
+    def handlePacketPokerInGame(self, packet):
+        self._startHand(packet.players)
+        return Table.handlePacketPokerInGame(self, packet)
+
+    def handlePacketPokerRaise(self, packet):
+        self._stats(packet.serial).raises += 1
+        if self._in_hand is not None and self._game_state == GAME_STATE_PRE_FLOP:
+            self._voluntary.add(packet.serial)
+            self._raised.add(packet.serial)
+        return Table.handlePacketPokerRaise(self, packet)
+
+    def handlePacketPokerCall(self, packet):
+        self._stats(packet.serial).calls += 1
+        if self._in_hand is not None and self._game_state == GAME_STATE_PRE_FLOP:
+            self._voluntary.add(packet.serial)
+        return Table.handlePacketPokerCall(self, packet)
+
+    def handlePacketPokerFold(self, packet):
+        if self._in_hand is not None:
+            self._folded.add(packet.serial)
+        return Table.handlePacketPokerFold(self, packet)
+
+    @handles(networkpackets.PACKET_POKER_WIN)
+    def handlePacketPokerWin(self, packet):
+        self._finishHand(set(packet.serials))
+
+
+class StatsProtocol(HeadlessProtocol):
+    table_class = StatsTable
+
+    def __init__(self, state):
+        # serial: PlayerStats
+        self.stats = {}
+        HeadlessProtocol.__init__(self, state)
+
+
+class StatsEngine(ReplayEngine):
+    protocol_class = StatsProtocol
+
+
+def analyzeFile(filename):
+    """returns (filename, {serial: PlayerStats}, packets, errors) of a log, runs in a worker process"""
+    # no seeking, so no snapshots
+    engine = StatsEngine(filename, snapshot_every=None)
+    engine.run()
+    return filename, engine.protocol.stats, engine.packets, engine.errors
+
+def mergeStats(total, stats):
+    """add the {serial: PlayerStats} stats to total"""
+    for serial, player_stats in stats.iteritems():
+        if serial in total:
+            total[serial].merge(player_stats)
+        else:
+            total[serial] = player_stats
+    return total
+
+def analyze(paths, processes=None, progress=None):
+    """returns the merged {serial: PlayerStats} of all log files in paths, progress is called with the result of every file"""
+    total = {}
+    pool = multiprocessing.Pool(processes)
+    try:
+        # the files differ in size, they are handed out one by one
+        for result in pool.imap_unordered(analyzeFile, iterLogFiles(paths), chunksize=1):
+            mergeStats(total, result[1])
+            if progress is not None:
+                progress(*result)
+    finally:
+        pool.terminate()
+    return total
+
+def formatStats(stats, min_hands=0):
+    """returns the lines of the statistics table, the players with the most hands first"""
+    lines = ["%10s %8s %6s %6s %6s %6s %6s" % ("serial", "hands", "vpip", "pfr", "af", "wsd", "sd")]
+    for serial, player in sorted(stats.iteritems(), key=lambda item: (-item[1].hands, item[0])):
+        if player.hands < min_hands:
+            continue
+        af = player.aggressionFactor()
+        lines.append("%10d %8d %5.1f%% %5.1f%% %6s %5.1f%% %6d" % (
+            serial, player.hands, player.vpipRate() * 100, player.pfrRate() * 100,
+            "-" if af is None else "%.2f" % af, player.showdownWinRate() * 100, player.showdowns))
+    return lines
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="per player statistics of packet logs")
+    parser.add_argument("logs", nargs="+", help="log files or directories")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--min-hands", type=int, default=1, help="leave out players with fewer hands")
+    args = parser.parse_args(argv)
+
+    counts = {"files": 0, "packets": 0, "errors": 0}
+    def progress(filename, stats, packets, errors):
+        counts["files"] += 1
+        counts["packets"] += packets
+        counts["errors"] += errors
+        if errors:
+            print >> sys.stderr, "%s: %d errors" % (filename, errors)
+    start = time.time()
+    stats = analyze(args.logs, args.processes, progress)
+    elapsed = max(time.time() - start, 1e-9)
+    for line in formatStats(stats, args.min_hands):
+        print line
+    print "%(files)d files, %(packets)d packets, %(errors)d errors" % counts, "in %.2fs (%.0f packets/s)" % (elapsed, counts["packets"] / elapsed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
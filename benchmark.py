@@ -0,0 +1,505 @@
+#!/usr/bin/env python
+"""
+benchmarks for the client side packet processing
+
+    python benchmark.py [packets] [--hands n] [--baseline file] [--save-baseline] [--check] [--tolerance 0.2]
+
+dispatch: packets/sec through PokerClientProtocol._handleConnection with the
+    per state dispatch tables, compared to the old closure/locals() dispatch
+parse: lines/sec of replay.iterPackets over logged packets, compared to the
+    old split/find parser
+table: packets/sec of full hands at a 10 seat table through
+    PokerClientProtocol._handleConnection (and the questions of a bot, and
+    Table.getDebugLines), with the
+    highest bet, the positions and the active players kept up to date, compared
+    to computing them from scratch every time
+suite: packets/sec of synthetic sessions (lobby and full hands up to the
+    showdown) through PokerClientProtocol._handleConnection with a NullScreen,
+    through Table.explain alone and through Table.explain plus getDebugLines,
+    the objects the packets leave behind (gc tracked objects that are still
+    alive or wait for the collector after the packet, a leak or a growing
+    cache shows up here) and, if tracemalloc (on python 2 the pytracemalloc
+    backport) is installed, the memory allocated per packet (the high water
+    mark of the blocks traced while the packet is handled, so blocks freed
+    again count as well). --save-baseline stores the results (per user, the
+    numbers are only comparable on the same machine), --check fails (exit
+    code 1) if a result is more than tolerance worse than the baseline.
+"""
+import os, sys, gc, time, random
+import simplejson
+from pokerpackets import packets, networkpackets
+from pokerpackets.packets import PacketFactory
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import replay
+
+from dispatch import dispatchTable
+from pokerprotocol import PokerClientProtocol, NullScreen, STATE_LOGIN, STATE_SEARCH, STATE_JOIN, STATE_PLAYING
+from explain import Table, GAME_STATE_BLIND_ANTE, GAME_STATE_PRE_FLOP, GAME_STATE_FLOP, GAME_STATE_TURN, \
+    GAME_STATE_RIVER, GAME_STATE_END
+
+BASELINE = os.path.expanduser("~/.pokercli-benchmark-baseline.json")
+AVATAR_SERIAL = 1
+
+
+class BenchProtocol(PokerClientProtocol):
+    """protocol that does not need a connection"""
+
+    def __init__(self):
+        PokerClientProtocol.__init__(self, NullScreen(), msgpokerurl="http://localhost/")
+        self.avatar.serial = AVATAR_SERIAL
+
+    def sendPacket(self, packet):
+        pass
+
+
+class LegacyBenchProtocol(BenchProtocol):
+    """the dispatch as it was before the dispatch tables, kept to compare against"""
+
+    def _get_handler(self, state):
+        try:
+            return getattr(self, "handle" + state.capitalize())
+        except:
+            return self.defaultHandler
+
+    def _handleConnection(self, packet):
+        self.screenObj.addLine("> " + str(packet))
+
+        if self._get_handler(self.state)(packet):
+            self.defaultHandler(packet)
+
+    def handleLogin(self, packet):
+        return False
+
+    def handleSearch(self, packet):
+        def handlePacketSerial(packet):
+            pass
+        def handlePacketPokerPlayerInfo(packet):
+            pass
+        def handlePacketPokerUserInfo(packet):
+            pass
+        def handlePacketPokerTableList(packet):
+            pass
+        def handlePacketPokerTable(packet):
+            pass
+        try:
+            handle = locals()["handle"+packet.__class__.__name__]
+            handle(packet)
+            return False
+        except KeyError:
+            return True
+
+    def handleJoin(self, packet):
+        def handlePacketPokerBuyInLimits(packet):
+            return True
+        def handlePacketPokerStart(packet):
+            pass
+        try:
+            handle = locals()["handle"+packet.__class__.__name__]
+            handle(packet)
+            return False
+        except KeyError:
+            return True
+
+    def handlePlaying(self, packet):
+        def handlePacketPokerPosition(packet):
+            self.logIt("POSITION pp:%s, mp:%s, chips:%s" % (packet.position,self.myPosition(), self.avatar.getChips()))
+            if packet.position == self.myPosition():
+                self.itsYourTurn()
+        try:
+            handle = locals()["handle"+packet.__class__.__name__]
+            handle(packet)
+            return False
+        except KeyError:
+            return True
+
+
+class LegacyTable(Table):
+    """the derived values computed from scratch as before the incremental bookkeeping, kept to compare against"""
+
+    def highestBetNotFold(self):
+        return max([0]+[p._bet for p in self.players.values() if p.serial in self.in_game and p.notFold()])
+
+    def isInPosition(self, serial):
+        return serial in self.in_game and self.position == self.in_game.index(serial)
+
+    def positionOf(self, serial):
+        if serial not in self.in_game:
+            return None
+        return self.in_game.index(serial)
+
+    def opponents(self):
+        return max(1, len([serial for serial in self.in_game if serial != self.avatar.serial and
+                           (serial not in self.players or self.players[serial].notFold())]))
+
+    def _setInGame(self, serials):
+        self.in_game = serials
+
+    def _betChanged(self, player, before):
+        pass
+
+    def _fold(self, serial):
+        if serial in self.players:
+            self.players[serial]._fold = True
+
+
+class LegacyTableProtocol(BenchProtocol):
+    table_class = LegacyTable
+
+
+def legacyGetPacketFromString(astring):
+    """the parser of replay.py as it was before the tokenizer, kept to compare against"""
+    name, rest = astring.split(" ",1)
+    params = legacyGetParamsFromString(rest)
+    packet_type = getattr(replay, "PACKET_" + name)
+    packet = PacketFactory[packet_type]
+    type_lookup = {}
+    for field, _, var_type in packet.info:
+        type_lookup[field]=var_type
+    converter = {
+        "I": lambda x:int(x),
+        "B": lambda x:int(x),
+        "Bnone": lambda x:int(x) if x != 255 else None,
+        "Q": lambda x:int(x),
+        "bool": lambda x: x == "True",
+    }
+    clean_params = {}
+    for field, value in params.items():
+        var_type = type_lookup[field]
+        clean_params[field] = converter[var_type](value) if var_type in converter else value
+    return packet(**clean_params)
+
+def legacyGetParamsFromString(paramString):
+    params = {}
+    rest = paramString.strip()
+    next_equal = 1
+    while next_equal >= 0:
+        name, rest = rest.split(" ",1)
+        _, rest = rest.split(" ",1)
+        if rest.startswith("["):
+            end = rest.find("]")
+            packets = rest[1:end ].split(', ')
+            if packets[0].isdigit():
+                value = list(map(int, packets))
+            else:
+                value = [legacyGetPacketFromString(packet) for packet in packets]
+            rest = rest[end+1:].strip()
+            next_equal = rest.find("=")
+        else:
+            next_equal = rest.find("=")
+            if next_equal == -1:
+                value = rest
+            else:
+                tmp = rest[:next_equal-1][::-1].find(" ")
+                value, rest = rest[:next_equal-2-tmp], rest[next_equal-1-tmp:]
+        params[name]=value
+    return params
+
+def legacyIterPackets(lines):
+    for line in lines:
+        if line.startswith("> ") or line.startswith("< "):
+            yield line[:2], legacyGetPacketFromString(line[2:].rstrip("\n"))
+
+def playingStream(count, game_id=1):
+    """returns a synthetic stream of packets as they arrive while playing at a table"""
+    serials = range(2, 11)
+    templates = [
+        lambda serial: networkpackets.PacketPokerPosition(game_id=game_id, position=serial % 9, serial=serial),
+        lambda serial: networkpackets.PacketPokerCall(game_id=game_id, serial=serial),
+        lambda serial: networkpackets.PacketPokerRaise(game_id=game_id, serial=serial, amount=200),
+        lambda serial: networkpackets.PacketPokerPlayerChips(game_id=game_id, serial=serial, money=10000, bet=200),
+        lambda serial: networkpackets.PacketPokerFold(game_id=game_id, serial=serial),
+        lambda serial: networkpackets.PacketPokerCheck(game_id=game_id, serial=serial),
+        lambda serial: networkpackets.PacketPokerSit(game_id=game_id, serial=serial),
+    ]
+    return [templates[i % len(templates)](serials[i % len(serials)]) for i in xrange(count)]
+
+def packetsPerSecond(handle, stream, repeat=3):
+    """returns the best packets/sec of several runs of handle over the stream"""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for packet in stream:
+            handle(packet)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(stream) / max(best, 1e-9)
+
+def benchDispatch(count):
+    """returns packets/sec of the old and the new dispatch for every state"""
+    stream = playingStream(count)
+    results = []
+    for state in (STATE_LOGIN, STATE_SEARCH, STATE_JOIN, STATE_PLAYING):
+        rates = []
+        for protocol_class in (LegacyBenchProtocol, BenchProtocol):
+            protocol = protocol_class()
+            protocol.state = state
+            protocol._handlers = dispatchTable(protocol_class).get(state, {})
+            rates.append(packetsPerSecond(protocol._handleConnection, stream))
+        results.append((state, rates[0], rates[1]))
+    return results
+
+def linesPerSecond(parse, lines, repeat=3):
+    """returns the best lines/sec of several runs of the parser over the lines"""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for _ in parse(lines):
+            pass
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(lines) / max(best, 1e-9)
+
+def benchParse(count):
+    """returns lines/sec of the old and the new parser over a synthetic log"""
+    lines = ["> %s\n" % packet for packet in playingStream(count)]
+    return linesPerSecond(legacyIterPackets, lines), linesPerSecond(replay.iterPackets, lines)
+
+
+def lobbyStream(tables=50, game_id=1, players=6):
+    """returns the packets from the login up to the seated players of the joined table"""
+    stream = [packets.PacketAuthOk(), packets.PacketSerial(serial=AVATAR_SERIAL)]
+    stream.append(networkpackets.PacketPokerTableList(packets=[
+        networkpackets.PacketPokerTable(id=table_id, name="table%d" % table_id, seats=10, players=table_id % 10,
+            betting_structure="%d-%d_%d-%d_no-limit" % (table_id, 2 * table_id, 10 * table_id, 100 * table_id))
+        for table_id in range(1, tables + 1)]))
+    stream.append(networkpackets.PacketPokerTable(id=game_id, name="table%d" % game_id, seats=10, players=players,
+        betting_structure="1-2_10-100_no-limit"))
+    stream.append(networkpackets.PacketPokerBuyInLimits(game_id=game_id, min=1000, max=10000, best=10000, rebuy_min=1000))
+    serials = range(AVATAR_SERIAL, AVATAR_SERIAL + players)
+    stream.append(networkpackets.PacketPokerSeats(game_id=game_id, seats=serials + [0] * (10 - players)))
+    for seat, serial in enumerate(serials):
+        stream.append(networkpackets.PacketPokerPlayerArrive(game_id=game_id, serial=serial, name="player%d" % serial, seat=seat))
+        stream.append(networkpackets.PacketPokerPlayerChips(game_id=game_id, serial=serial, money=10000, bet=0))
+        stream.append(networkpackets.PacketPokerSit(game_id=game_id, serial=serial))
+    return stream
+
+def handStream(hands, game_id=1, players=6, seed=0):
+    """returns the packets of full hands: blinds, cards, four betting rounds, showdown"""
+    rng = random.Random(seed)
+    serials = range(AVATAR_SERIAL, AVATAR_SERIAL + players)
+    stream = []
+    def packet(cls, **kw):
+        stream.append(cls(game_id=game_id, **kw))
+    for hand in xrange(hands):
+        dealer = hand % players
+        packet(networkpackets.PacketPokerStart, hand_serial=hand + 1)
+        packet(networkpackets.PacketPokerInGame, players=serials)
+        packet(networkpackets.PacketPokerDealer, dealer=dealer, previous_dealer=(dealer - 1) % players)
+        packet(networkpackets.PacketPokerState, string=GAME_STATE_BLIND_ANTE)
+        for offset, amount in ((1, 100), (2, 200)):
+            serial = serials[(dealer + offset) % players]
+            packet(networkpackets.PacketPokerBlind, serial=serial, amount=amount)
+            packet(networkpackets.PacketPokerPlayerChips, serial=serial, money=10000 - amount, bet=amount)
+        deck = rng.sample(range(52), 2 * players + 5)
+        pockets = dict((serial, deck[2 * index:2 * index + 2]) for index, serial in enumerate(serials))
+        for serial in serials:
+            packet(networkpackets.PacketPokerPlayerCards, serial=serial,
+                cards=pockets[serial] if serial == AVATAR_SERIAL else [255, 255])
+        folded = set()
+        board = deck[2 * players:]
+        for state, cards in ((GAME_STATE_PRE_FLOP, 0), (GAME_STATE_FLOP, 3), (GAME_STATE_TURN, 4), (GAME_STATE_RIVER, 5)):
+            packet(networkpackets.PacketPokerState, string=state)
+            if cards:
+                packet(networkpackets.PacketPokerBoardCards, cards=board[:cards])
+            for step in range(players):
+                position = (dealer + 3 + step) % players
+                serial = serials[position]
+                if serial in folded:
+                    continue
+                packet(networkpackets.PacketPokerPosition, serial=serial, position=position)
+                action = rng.random()
+                if action < 0.15 and len(folded) < players - 2:
+                    folded.add(serial)
+                    packet(networkpackets.PacketPokerFold, serial=serial)
+                elif action < 0.3 and state == GAME_STATE_PRE_FLOP:
+                    packet(networkpackets.PacketPokerRaise, serial=serial, amount=400)
+                elif state == GAME_STATE_PRE_FLOP:
+                    packet(networkpackets.PacketPokerCall, serial=serial)
+                else:
+                    packet(networkpackets.PacketPokerCheck, serial=serial)
+        showdown = [serial for serial in serials if serial not in folded]
+        for serial in showdown:
+            packet(networkpackets.PacketPokerPlayerCards, serial=serial, cards=pockets[serial])
+        packet(networkpackets.PacketPokerWin, serials=[rng.choice(showdown)])
+        for serial in serials:
+            packet(networkpackets.PacketPokerPlayerChips, serial=serial, money=10000, bet=0)
+        packet(networkpackets.PacketPokerState, string=GAME_STATE_END)
+    return stream
+
+def _playingTable(players=6, protocol_class=BenchProtocol):
+    """returns a BenchProtocol that is seated at a table, and its table"""
+    protocol = protocol_class()
+    for packet in lobbyStream(players=players):
+        protocol._handleConnection(packet)
+    protocol.changeState(STATE_PLAYING)
+    return protocol, protocol.table
+
+def _measure(setup, stream, repeat=3):
+    """returns (packets/sec of the best of several runs, objects left behind/packet, allocated bytes/packet or None),
+    setup returns the function that handles one packet"""
+    best = None
+    for _ in range(repeat):
+        handle = setup()
+        start = time.time()
+        for packet in stream:
+            handle(packet)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    handle = setup()
+    gc.collect()
+    # without the collector the garbage in cycles is counted as well
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        for packet in stream:
+            handle(packet)
+        objects = float(len(gc.get_objects()) - before) / len(stream)
+    finally:
+        gc.enable()
+    allocated = None
+    if tracemalloc is not None:
+        handle = setup()
+        total = 0
+        try:
+            for packet in stream:
+                # tracing starts from nothing for every packet, the peak is what the packet allocated
+                tracemalloc.start()
+                handle(packet)
+                total += tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        finally:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+        allocated = float(total) / len(stream)
+    return len(stream) / max(best, 1e-9), objects, allocated
+
+def benchTable(hands, players=10):
+    """returns [(benchmark, packets/sec computing from scratch, packets/sec incremental)] at a full table"""
+    stream = handStream(hands, players=players)
+    results = []
+    for name in ("explain", "explain+bot", "explain+debug"):
+        rates = []
+        for protocol_class in (LegacyTableProtocol, BenchProtocol):
+            protocol, table = _playingTable(players, protocol_class)
+            if name == "explain+debug":
+                def handle(packet):
+                    protocol._handleConnection(packet)
+                    table.getDebugLines()
+            elif name == "explain+bot":
+                # what a bot asks before every decision
+                def handle(packet):
+                    protocol._handleConnection(packet)
+                    table.highestBetNotFold()
+                    table.opponents()
+                    table.isInPosition(table.avatar.serial)
+            else:
+                handle = protocol._handleConnection
+            rates.append(packetsPerSecond(handle, stream))
+        results.append((name, rates[0], rates[1]))
+    return results
+
+def benchSuite(hands=1000):
+    """returns {benchmark: {"pps": packets/sec, "bytes": allocated bytes/packet or None}}"""
+    session = lobbyStream() + handStream(hands)
+    hand_packets = handStream(hands)
+    def protocolSetup():
+        return BenchProtocol()._handleConnection
+    def explainSetup():
+        protocol, table = _playingTable()
+        return lambda packet: table.explain(packet, STATE_PLAYING)
+    def debugSetup():
+        protocol, table = _playingTable()
+        def handle(packet):
+            table.explain(packet, STATE_PLAYING)
+            table.getDebugLines()
+        return handle
+    results = {}
+    for name, setup, stream in (("protocol", protocolSetup, session),
+                                ("explain", explainSetup, hand_packets),
+                                ("explain+debug", debugSetup, hand_packets)):
+        pps, objects, allocated = _measure(setup, stream)
+        results[name] = {"pps": pps, "objects": objects, "bytes": allocated}
+    return results
+
+def regressions(results, baseline, tolerance):
+    """returns the lines describing the results that are more than tolerance worse than the baseline"""
+    found = []
+    for name, result in sorted(results.iteritems()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["pps"] < base["pps"] * (1 - tolerance):
+            found.append("%s: %.0f packets/s, baseline %.0f" % (name, result["pps"], base["pps"]))
+        # a tenth of an object per packet is noise
+        if base.get("objects") is not None and result["objects"] > base["objects"] * (1 + tolerance) + 0.1:
+            found.append("%s: %.2f objects/packet, baseline %.2f" % (name, result["objects"], base["objects"]))
+        if result["bytes"] is not None and base.get("bytes") is not None and result["bytes"] > base["bytes"] * (1 + tolerance):
+            found.append("%s: %.0f bytes/packet, baseline %.0f" % (name, result["bytes"], base["bytes"]))
+    return found
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="benchmarks of the packet processing")
+    parser.add_argument("packets", type=int, nargs="?", default=50000, help="packets of the dispatch and parse comparisons")
+    parser.add_argument("--hands", type=int, default=1000, help="hands of the synthetic sessions of the suite")
+    parser.add_argument("--baseline", default=BASELINE, help="json file of the baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results of the suite as the baseline")
+    parser.add_argument("--check", action="store_true", help="fail if the suite is worse than the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="accepted slowdown (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    count = args.packets
+    if not args.check:
+        print "dispatch (%d packets)" % count
+        print "%-10s %14s %14s %8s" % ("state", "before pkt/s", "after pkt/s", "speedup")
+        for state, before, after in benchDispatch(count):
+            print "%-10s %14.0f %14.0f %7.2fx" % (state, before, after, after / before)
+        print
+        print "parse (%d lines)" % count
+        before, after = benchParse(count)
+        print "%-10s %14s %14s %8s" % ("", "before line/s", "after line/s", "speedup")
+        print "%-10s %14.0f %14.0f %7.2fx" % ("", before, after, after / before)
+        print
+        print "table (10 seats, %d hands)" % args.hands
+        print "%-14s %14s %14s %8s" % ("", "before pkt/s", "after pkt/s", "speedup")
+        for name, before, after in benchTable(args.hands):
+            print "%-14s %14.0f %14.0f %7.2fx" % (name, before, after, after / before)
+        print
+
+    print "suite (%d hands)" % args.hands
+    results = benchSuite(args.hands)
+    print "%-14s %12s %12s %12s" % ("", "pkt/s", "objs/pkt", "bytes/pkt")
+    for name in sorted(results):
+        result = results[name]
+        print "%-14s %12.0f %12.2f %12s" % (name, result["pps"], result["objects"],
+            "-" if result["bytes"] is None else "%.0f" % result["bytes"])
+    if tracemalloc is None:
+        print "(no tracemalloc, the bytes allocated are not measured, install pytracemalloc on python 2)"
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as fd:
+            simplejson.dump(results, fd, indent=2, sort_keys=True)
+        print "baseline written to %s" % args.baseline
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print "no baseline %s, run with --save-baseline first" % args.baseline
+            return 1
+        with open(args.baseline) as fd:
+            found = regressions(results, simplejson.load(fd), args.tolerance)
+        for line in found:
+            print "REGRESSION " + line
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,198 @@
+"""
+compact binary packet log
+
+Instead of str(packet) the client can log the pokerpackets wire bytes of every
+packet it receives and sends. The reader memory maps the log and decodes a
+packet only when it is asked for, replay and analytics skip text parsing.
+
+file format (little endian):
+    header  magic "PKBL", version (B), compression (B: 0 none, 1 zlib, 2 lzma)
+    records timestamp (d), direction (B: 0 received, 1 sent), length (I), wire bytes
+            (compressed as one stream behind the header if compression is used)
+"""
+import mmap, struct, time, zlib
+from twisted.internet import reactor
+from pokerpackets.binarypack import pack, unpack
+
+from replay import DIRECTION_IN, DIRECTION_OUT
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+MAGIC = "PKBL"
+VERSION = 1
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+COMPRESSIONS = {None: COMPRESSION_NONE, "zlib": COMPRESSION_ZLIB, "lzma": COMPRESSION_LZMA}
+
+# index in the record: direction of the text logs
+_DIRECTIONS = (DIRECTION_IN, DIRECTION_OUT)
+
+_header = struct.Struct("<4sBB")
+_record = struct.Struct("<dBI")
+# bytes decompressed at once while reading a compressed log
+_CHUNK = 256 * 1024
+
+
+class BinaryLogError(Exception):
+    pass
+
+
+def _compressor(compression):
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compressobj()
+    if compression == COMPRESSION_LZMA:
+        if lzma is None:
+            raise BinaryLogError("lzma compression needs the lzma module (backports.lzma on python 2)")
+        return lzma.LZMACompressor()
+    return None
+
+def _decompressor(compression):
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompressobj()
+    if compression == COMPRESSION_LZMA:
+        if lzma is None:
+            raise BinaryLogError("lzma compressed logs need the lzma module (backports.lzma on python 2)")
+        return lzma.LZMADecompressor()
+    raise BinaryLogError("unknown compression %r" % compression)
+
+def isBinaryLog(filename):
+    """returns True if the file starts like a binary packet log"""
+    with open(filename, "rb") as fd:
+        return fd.read(len(MAGIC)) == MAGIC
+
+
+class BinaryLogWriter(object):
+    """appends the packets of a session to a binary log"""
+
+    def __init__(self, filename, compression=None):
+        self.filename = filename
+        self._compression = COMPRESSIONS[compression]
+        self._compressor = _compressor(self._compression)
+        self._fd = open(filename, "wb")
+        self._fd.write(_header.pack(MAGIC, VERSION, self._compression))
+        reactor.addSystemEventTrigger('before', 'shutdown', self.close)
+
+    def write(self, direction, packet):
+        """log a packet, direction is DIRECTION_IN or DIRECTION_OUT"""
+        if self._fd is None:
+            return
+        data = pack(packet)
+        record = _record.pack(time.time(), _DIRECTIONS.index(direction), len(data)) + data
+        if self._compressor is not None:
+            record = self._compressor.compress(record)
+        self._fd.write(record)
+
+    def flush(self):
+        """write everything logged so far to the file"""
+        if self._fd is None:
+            return
+        if self._compression == COMPRESSION_ZLIB:
+            # everything written so far can be decompressed
+            self._fd.write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        self._fd.flush()
+
+    def close(self):
+        """finish the compression and close the file"""
+        if self._fd is None:
+            return
+        if self._compressor is not None:
+            self._fd.write(self._compressor.flush())
+        self._fd.close()
+        self._fd = None
+
+
+class Record(object):
+    """one logged packet, it is decoded on the first access of packet"""
+
+    def __init__(self, timestamp, direction, data, end):
+        self.timestamp = timestamp
+        self.direction = direction
+        self.data = data
+        # position behind the record, iterRecords can start there
+        self.end = end
+        self._packet = None
+
+    @property
+    def type(self):
+        """the packet type, read from the wire header without decoding the packet"""
+        return ord(self.data[0])
+
+    @property
+    def packet(self):
+        if self._packet is None:
+            _, self._packet = unpack(str(self.data))
+        return self._packet
+
+
+class BinaryLogReader(object):
+    """memory mapped binary packet log"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as fd:
+            self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _header.size:
+            raise BinaryLogError("%s: file too short" % filename)
+        magic, version, self.compression = _header.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise BinaryLogError("%s: no binary packet log of version %d" % (filename, VERSION))
+
+    def __iter__(self):
+        return self.iterRecords()
+
+    def iterRecords(self, start=0):
+        """yields the records behind start (the end of an earlier record), a half written last record is left out"""
+        if self.compression == COMPRESSION_NONE:
+            return self._iterMapped(start)
+        return self._iterCompressed(start)
+
+    def _iterMapped(self, start):
+        offset = max(start, _header.size)
+        size = len(self._map)
+        while offset + _record.size <= size:
+            timestamp, direction, length = _record.unpack_from(self._map, offset)
+            end = offset + _record.size + length
+            if end > size:
+                break
+            # a view into the map, the bytes are not copied
+            yield Record(timestamp, _DIRECTIONS[direction], buffer(self._map, offset + _record.size, length), end)
+            offset = end
+
+    def _iterCompressed(self, start):
+        # positions are offsets in the decompressed stream, it has to be decompressed from the beginning
+        decompressor = _decompressor(self.compression)
+        data = ""
+        position = 0
+        for chunk_start in xrange(_header.size, len(self._map), _CHUNK):
+            data += decompressor.decompress(self._map[chunk_start:chunk_start + _CHUNK])
+            offset = 0
+            while offset + _record.size <= len(data):
+                timestamp, direction, length = _record.unpack_from(data, offset)
+                end = offset + _record.size + length
+                if end > len(data):
+                    break
+                if position + end > start:
+                    yield Record(timestamp, _DIRECTIONS[direction], data[offset + _record.size:end], position + end)
+                offset = end
+            data = data[offset:]
+            position += offset
+
+    def close(self):
+        self._map.close()
+
+
+def iterPackets(filename):
+    """yields (direction, packet) for every packet in the binary log, like replay.iterFile"""
+    reader = BinaryLogReader(filename)
+    try:
+        for record in reader:
+            yield record.direction, record.packet
+    finally:
+        reader.close()
@@ -0,0 +1,43 @@
+"""
+class level packet dispatch tables
+
+Handlers are ordinary methods marked with the handles decorator. The table that
+maps a state and a packet type to its handler is built once per class, the first
+time it is asked for, so dispatching a packet costs a dict lookup instead of
+building closures and searching locals() for every packet.
+
+    class Foo(object):
+        @handles(PACKET_POKER_CALL, PACKET_POKER_RAISE, state="playing")
+        def handlePacketPokerAction(self, packet):
+            ...
+
+    dispatchTable(Foo)["playing"][PACKET_POKER_CALL](foo, packet)
+
+Subclasses can mark their own methods to register additional handlers, or
+override a marked method (by name) to replace an existing one.
+"""
+import inspect
+
+
+def handles(*packet_types, **kw):
+    """marks a method as handler for the given packet types (in the given state, if any)"""
+    state = kw.pop("state", None)
+    assert not kw, "unexpected keyword arguments %r" % (kw,)
+    def mark(fn):
+        fn._handles = getattr(fn, "_handles", ()) + tuple((state, packet_type) for packet_type in packet_types)
+        return fn
+    return mark
+
+def dispatchTable(cls):
+    """returns the dispatch table {state: {packet_type: function}} of the class, it is built only once"""
+    table = cls.__dict__.get("_dispatch_table")
+    if table is None:
+        table = {}
+        for klass in reversed(inspect.getmro(cls)):
+            for name, attr in klass.__dict__.items():
+                for state, packet_type in getattr(attr, "_handles", ()):
+                    # resolve by name, so a subclass can override a handler without marking it again
+                    fn = getattr(cls, name)
+                    table.setdefault(state, {})[packet_type] = getattr(fn, "im_func", fn)
+        cls._dispatch_table = table
+    return table
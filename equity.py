@@ -0,0 +1,160 @@
+"""
+monte carlo equity of a hand against random opponent hands
+
+The simulation is split into batches that run in a process pool. The pool is
+driven from a thread of the reactor thread pool, so the reactor never blocks
+while the workers sample. Results are cached per (hole cards, board, opponents)
+and a later, bigger request only samples the missing iterations.
+"""
+import multiprocessing, signal
+from twisted.internet import reactor, defer, threads
+from pokereval import PokerEval
+
+from handeval import LRUCache
+
+UNKNOWN_CARD = 255
+
+_calculator = None
+# the PokerEval of a worker process
+_worker_eval = None
+
+
+def _initWorker():
+    """runs in a new worker process, the signal handlers of the reactor are inherited and would keep it alive"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # ctrl-c is for the parent, it stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _simulate(args):
+    """runs in a worker process, returns (wins, ties, samples) of the hole cards"""
+    global _worker_eval
+    hole, board, opponents, iterations = args
+    if _worker_eval is None:
+        _worker_eval = PokerEval()
+    pockets = [list(hole)] + [[UNKNOWN_CARD, UNKNOWN_CARD] for _ in range(opponents)]
+    board = list(board) + [UNKNOWN_CARD] * (5 - len(board))
+    result = _worker_eval.poker_eval(game="holdem", pockets=pockets, board=board, dead=[], iterations=iterations)
+    hero = result['eval'][0]
+    return hero['winhi'], hero['tiehi'], result['info'][0]
+
+
+class EquityError(Exception):
+    pass
+
+
+class Equity(object):
+    """result of an equity estimation"""
+
+    def __init__(self, wins=0, ties=0, samples=0):
+        self.wins = wins
+        self.ties = ties
+        self.samples = samples
+
+    def win(self):
+        """returns the probability to win"""
+        return float(self.wins) / self.samples if self.samples else 0.0
+
+    def tie(self):
+        """returns the probability to split the pot"""
+        return float(self.ties) / self.samples if self.samples else 0.0
+
+    def add(self, wins, ties, samples):
+        """returns a new Equity with additional samples"""
+        return Equity(self.wins + wins, self.ties + ties, self.samples + samples)
+
+    def __str__(self):
+        return "win %.1f%% tie %.1f%% (%d samples)" % (self.win() * 100, self.tie() * 100, self.samples)
+
+
+class EquityCalculator(object):
+    """estimates equities in a process pool, use getCalculator() to get the one of the process"""
+
+    # iterations simulated by one task of the pool
+    batch_size = 10000
+    # seconds the waiting thread sleeps before it looks whether the calculator was closed
+    poll_interval = 0.1
+
+    def __init__(self, processes=None, maxsize=1000):
+        self.processes = processes
+        self._pool = None
+        self._closed = False
+        self._cache = LRUCache(maxsize)
+        self._pending = {}
+
+    def _key(self, hole, board, opponents):
+        return tuple(sorted(hole)), tuple(sorted(board)), opponents
+
+    def _getPool(self):
+        if self._pool is None:
+            self._closed = False
+            self._pool = multiprocessing.Pool(self.processes, _initWorker)
+            reactor.addSystemEventTrigger('before', 'shutdown', self.close)
+        return self._pool
+
+    def isAvailable(self):
+        """returns True if estimations can run, the results are delivered by the reactor"""
+        return reactor.running
+
+    def cached(self, hole, board, opponents):
+        """returns the cached Equity or None"""
+        return self._cache.get(self._key(hole, board, opponents))
+
+    def isPending(self, hole, board, opponents):
+        """returns True if an estimation of the hand is running"""
+        return self._key(hole, board, opponents) in self._pending
+
+    def estimate(self, hole, board, opponents, iterations):
+        """returns a deferred that fires with the Equity of the hole cards against opponents random hands"""
+        key = self._key(hole, board, opponents)
+        equity = self._cache.get(key) or Equity()
+        if equity.samples >= iterations:
+            return defer.succeed(equity)
+        if key in self._pending:
+            # the same hand is estimated already, what it does not sample is sampled behind it
+            d = defer.Deferred()
+            self._pending[key].append(d)
+            d.addCallback(lambda _: self.estimate(hole, board, opponents, iterations))
+            return d
+        missing = iterations - equity.samples
+        batches = [(key[0], key[1], opponents, min(self.batch_size, missing - start))
+                   for start in range(0, missing, self.batch_size)]
+        waiting = self._pending[key] = [defer.Deferred()]
+        def done(results):
+            equity = self._cache.get(key) or Equity()
+            for wins, ties, samples in results:
+                equity = equity.add(wins, ties, samples)
+            self._cache[key] = equity
+            return equity
+        def fire(result):
+            del self._pending[key]
+            for d in waiting:
+                d.callback(result)
+        d = threads.deferToThread(self._wait, self._getPool().map_async(_simulate, batches))
+        d.addCallback(done)
+        d.addBoth(fire)
+        return waiting[0]
+
+    def _wait(self, result):
+        """runs in a thread of the reactor, returns the results of the batches unless the calculator is closed"""
+        while not result.ready():
+            if self._closed:
+                raise EquityError("the calculator was closed")
+            result.wait(self.poll_interval)
+        return result.get()
+
+    def close(self):
+        """stop the worker processes, the threads waiting for them give up"""
+        self._closed = True
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+def getCalculator():
+    """returns the calculator shared by the whole process"""
+    global _calculator
+    if _calculator is None:
+        _calculator = EquityCalculator()
+    return _calculator
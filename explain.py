@@ -1,6 +1,10 @@
-import traceback, sys
+import traceback, sys, copy
 from pokerpackets import networkpackets
-from pokereval import PokerEval
+
+from dispatch import handles, dispatchTable
+from handeval import getEvaluator
+from equity import getCalculator
+from preflop import getPreflopTable
 
 
 def catcher(fn):
@@ -34,10 +38,30 @@ GAME_STATE_FIFTH = "fifth"
 GAME_STATE_MUCK = "muck"
 GAME_STATE_END = "end"
 
+# iterations of the equity estimation shown in the debug lines
+DEBUG_EQUITY_ITERATIONS = 20000
+
+# betting structure: (small blind, big blind, min buy in, max buy in, limit)
+_betting_structures = {}
+
+def parseBettingStructure(betting_structure):
+    """returns (small blind, big blind, min buy in, max buy in, limit) of a betting structure like
+    "1-2_10-100_no-limit", the amounts in cents. Every betting structure is parsed once"""
+    parsed = _betting_structures.get(betting_structure)
+    if parsed is None:
+        blinds, buy_ins, limit = betting_structure.split('_')
+        min_buy_in, max_buy_in = buy_ins.split('-')
+        small, big = blinds.split('-')
+        parsed = _betting_structures[betting_structure] = (
+            int(small)*100, int(big)*100, int(min_buy_in)*100, int(max_buy_in)*100, limit)
+    return parsed
+
 
 class Player(object):
     """Player object handles money and game states of the player"""
 
+    __slots__ = ("serial", "money", "_chips", "_bet", "cards", "_fold", "seat", "name", "sit_out")
+
     def __init__(self, serial=None, **player_info):
         self.serial = serial
         self.money = {}
@@ -144,6 +168,8 @@ class NoneTable(object):
         self.board_cards = []
     def isInPosition(self, *args):
         return False
+    def positionOf(self, *args):
+        return None
     def getDebugLines(self, *args, **kw):
         return []
     def logIt(self, *args, **kw):
@@ -155,37 +181,75 @@ class NoneTable(object):
         return False
 
 class Table(object):
+    """
+        Keeps track of the game state at one table.
+
+        Packets are explained by the methods marked with @handles, subclasses can
+        register additional handlers for further packet types the same way.
+    """
+    __slots__ = ("protocol", "_handlers", "id", "seat", "seats", "name", "betting_structure",
+                 "small_blind", "big_blind", "min_buy_in", "max_buy_in", "avatar", "players", "_serial_and_game_id",
+                 "_eval", "_equity", "_preflop", "in_game", "_positions", "_active", "_highest_bet", "dealer",
+                 "board_cards", "position", "hand_serial", "_game_state", "version", "_debug_version", "_debug_lines")
+
     def __init__(self, protocol, avatar, table_info):
         self.protocol = protocol
+        self._handlers = dispatchTable(self.__class__).get(None, {})
         self.id = table_info.get('id', 0)
         self.seat = table_info.get('player_seated', -1)
         self.seats = [0] * table_info.get('seats', 10)
         if self.seat != -1:
             self.seats[self.seat] = avatar.serial
-            assert avatar.seat == self.seat, "as %s, ss %s" % (avatar.seat, self.seat)
         self.name = table_info.get('name', 'unnamed')
         self.betting_structure =  table_info['betting_structure']
-        blinds, buy_ins, limit = table_info['betting_structure'].split('_')
-        min_buy_in, max_buy_in = buy_ins.split('-')
-        small, big = blinds.split('-')
-
-        self.max_buy_in = int(max_buy_in)*100
-        self.min_buy_in = int(min_buy_in)*100
-        self.big_blind = int(big)*100
-        self.small_blind = int(small)*100
+        self.small_blind, self.big_blind, self.min_buy_in, self.max_buy_in, limit = \
+            parseBettingStructure(self.betting_structure)
 
-        self.players = {avatar.serial: avatar}
-        self.avatar = avatar
+        # the avatar has chips, a bet and cards at every table of its own, the bank money is shared
+        self.avatar = Player(serial=avatar.serial, name=avatar.name, seat=self.seat)
+        self.avatar.money = avatar.money
+        self.players = {avatar.serial: self.avatar}
         self._serial_and_game_id = dict(serial=avatar.serial, game_id=self.id)
-        self._eval = PokerEval()
+        self._eval = getEvaluator()
+        self._equity = getCalculator()
+        self._preflop = getPreflopTable()
+        self.in_game = []
+        # serial: position of the players of the hand
+        self._positions = {}
+        # serials of the players of the hand that did not fold
+        self._active = set()
+        # the highest bet of the active players
+        self._highest_bet = 0
+        self.dealer = -1
+        self.hand_serial = 0
         self.reset()
         self._game_state = GAME_STATE_NULL
+        # bumped whenever a packet changed the state, the debug lines are cached per version
+        # and bank money of the avatar (shared by the tables and updated by the protocol as well)
+        self.version = 0
+        self._debug_version = None
+        self._debug_lines = []
+
+    def __deepcopy__(self, memo):
+        """copies the game state, the protocol and the process wide services are shared"""
+        for shared in (self.protocol, self._eval, self._equity, self._preflop):
+            memo.setdefault(id(shared), shared)
+        clone = self.__class__.__new__(self.__class__)
+        memo[id(self)] = clone
+        for name in Table.__slots__:
+            setattr(clone, name, copy.deepcopy(getattr(self, name), memo))
+        # the attributes of subclasses without slots
+        for name, value in getattr(self, "__dict__", {}).iteritems():
+            setattr(clone, name, copy.deepcopy(value, memo))
+        return clone
 
     def reset(self):
         """reseting game states for a new hand"""
         self.board_cards = []
         self.position = -1
         self._reset_players()
+        self._active = set(self._positions)
+        self._highest_bet = 0
 
     def getBoardCards(self):
         """return a list of board games"""
@@ -195,9 +259,38 @@ class Table(object):
         """return a string of usefull information about the avatar"""
         return ", ".join(self._get_avatar_info())
 
+    def opponents(self):
+        """returns the number of opponents of the avatar in the current hand that did not fold (at least one)"""
+        return max(1, len(self._active) - (self.avatar.serial in self._active))
+
+    def estimateEquity(self, opponents=None, iterations=DEBUG_EQUITY_ITERATIONS):
+        """returns a deferred that fires with the Equity of the avatar hand in the current state"""
+        if opponents is None:
+            opponents = self.opponents()
+        d = self._equity.estimate(self.avatar.getCards(), self.getBoardCards(), opponents, iterations)
+        def changed(equity):
+            # the debug lines have to show the new equity
+            self.version += 1
+            return equity
+        d.addCallback(changed)
+        return d
+
+    def preflopEquity(self, opponents=None):
+        """returns the precomputed preflop equity of the avatar hand or None if it is not known"""
+        if self._preflop is None or len(self.avatar.cards) != 2:
+            return None
+        if opponents is None:
+            opponents = self.opponents()
+        card1, card2 = self.avatar.getCards()
+        return self._preflop.equity(card1, card2, opponents)
+
     def isInPosition(self, serial):
         """returs true if player with serial is in position"""
-        return serial in self.in_game and self.position == self.in_game.index(serial)
+        return self._positions.get(serial) == self.position
+
+    def positionOf(self, serial):
+        """returns the position of the player in the current hand or None"""
+        return self._positions.get(serial)
 
     def logIt(self, astr, prefix=" [D] "):
         """a little helper function to log output"""
@@ -220,7 +313,7 @@ class Table(object):
         self.seats[index] = serial
         # Request more information about this player
         if serial == self.avatar.serial:
-            self.players[index] = self.avatar
+            self.players[serial] = self.avatar
         else:
             self.protocol.sendPacket(networkpackets.PacketPokerGetUserInfo(serial=serial))
 
@@ -229,6 +322,8 @@ class Table(object):
         serial = self.seats[index]
         self.seats[index]=0
         if serial in self.players:
+            # while the player is known, the highest bet may have been theirs
+            self._fold(serial)
             del self.players[serial]
 
     def updatePlayer(self, player_info):
@@ -239,7 +334,9 @@ class Table(object):
     def updatePlayerChips(self, serial, chips, bet):
         """update players chips"""
         player = self._get_or_create_player(serial=serial)
-        return player.updateChips(chips, bet)
+        before = player._bet
+        player.updateChips(chips, bet)
+        self._betChanged(player, before)
 
     def updatePlayerCards(self, serial, cards):
         """update players cards"""
@@ -258,7 +355,45 @@ class Table(object):
 
     def highestBetNotFold(self):
         """returns the highest bet of all players that are not fold"""
-        return max([0]+[p._bet for p in self.players.values() if p.serial in self.in_game and p.notFold()])
+        return self._highest_bet
+
+    def _setInGame(self, serials):
+        """the players of the hand are known"""
+        self.in_game = serials
+        self._positions = dict((serial, position) for position, serial in enumerate(serials))
+        self._active = set(serial for serial in serials if serial not in self.players or self.players[serial].notFold())
+        self._updateHighestBet()
+
+    def _bet(self, player, amount):
+        """move chips of the player to the bet"""
+        before = player._bet
+        player.bet(amount)
+        self._betChanged(player, before)
+
+    def _betChanged(self, player, before):
+        """keep the highest bet up to date after the bet of the player changed"""
+        if player.serial not in self._active:
+            return
+        if player._bet >= self._highest_bet:
+            self._highest_bet = player._bet
+        elif before == self._highest_bet:
+            # the highest bet went down (the bets were collected), rare enough to look at all bets
+            self._updateHighestBet()
+
+    def _fold(self, serial):
+        """the player is out of the hand"""
+        if serial not in self._active:
+            return
+        self._active.discard(serial)
+        player = self.players.get(serial)
+        if player is not None:
+            player._fold = True
+            if player._bet == self._highest_bet:
+                self._updateHighestBet()
+
+    def _updateHighestBet(self):
+        players = self.players
+        self._highest_bet = max([0] + [players[serial]._bet for serial in self._active if serial in players])
     
     def inSmallBlindPosition(self):
         """returns True if the player in position is in small_blind position"""
@@ -314,72 +449,114 @@ class Table(object):
         self.protocol.sendPacket(networkpackets.PacketPokerRaise(amount=amount, **self._serial_and_game_id))
     
 
-    def explain(self, packet, state):
-        """packets that might be interesting for the game will be handled here"""
-        def handlePacketPokerBuyInLimits(packet):
-            self.max_buy_in = packet.max
-            self.min_buy_in = packet.min
-        def handlePacketPokerSeats(packet):
-            return self.updateSeats(packet.seats)
-        def handlePacketPokerPlayerInfo(packet):
-            self.updatePlayer(packet.__dict__)
-        def handlePacketPokerPlayerChips(packet):
-            return self.updatePlayerChips(packet.serial, chips=packet.money, bet=packet.bet)
-        def handlePacketPokerPlayerArrive(packet):
-            self.updatePlayer(packet.__dict__)
-        def handlePacketPokerPlayerLeave(packet):
-            self.removePlayer(packet.seat)
-        def handlePacketPokerSit(packet):
-            self._get_player(packet.serial).sit()
-        def handlePacketPokerSitOut(packet):
-            self._get_player(packet.serial).sitOut()
-        def handlePacketPokerRebuy(packet):
-            assert self.id == packet.game_id
-            self.rebuy(packet.serial, packet.amount)
-        def handlePacketPokerInGame(packet):
-            assert self.id == packet.game_id
-            self.in_game = packet.players
-        def handlePacketPokerPosition(packet):
-            assert self.id == packet.game_id
-            self.position = packet.position
-        def handlePacketPokerStart(packet):
-            assert self.id == packet.game_id
-            self.reset()
-            self.hand_serial = packet.hand_serial
-        def handlePacketPokerDealer(packet):
-            assert self.id == packet.game_id
-            # assert self.dealer == packet.previous_dealer
-            self.dealer = packet.dealer
-        def handlePacketPokerPlayerCards(packet):
-            self.updatePlayerCards(packet.serial, packet.cards)
-            if packet.serial == self.avatar.serial:
-                self.logIt("You got %r" % self._cards_to_string(packet.cards))
-        def handlePacketPokerBoardCards(packet):
-            self.board_cards = packet.cards
-        def handlePacketPokerRaise(packet):
-            self._get_player(packet.serial).bet(packet.amount)
-        def handlePacketPokerCall(packet):
-            player = self._get_player(packet.serial)
-            highestbet = self.highestBetNotFold()
-            bigb =self.bigBlind() if self._game_state == GAME_STATE_PRE_FLOP and not self.inSmallBlindPosition() else 0
-            # import rpdb2; rpdb2.start_embedded_debugger("haha")
-            self.logIt("%r, %r" % (highestbet,bigb))
-            amount = min(
-                max(highestbet,bigb) - player._bet,
-                player.money
-            )
-            player.bet(amount)
-        def handlePacketPokerState(packet):
-            self._game_state = packet.string
-        def handlePacketPokerBlind(packet):
-            self._get_player(packet.serial).bet(packet.amount)
+    @handles(networkpackets.PACKET_POKER_BUY_IN_LIMITS)
+    def handlePacketPokerBuyInLimits(self, packet):
+        self.max_buy_in = packet.max
+        self.min_buy_in = packet.min
+
+    @handles(networkpackets.PACKET_POKER_SEATS)
+    def handlePacketPokerSeats(self, packet):
+        return self.updateSeats(packet.seats)
+
+    @handles(networkpackets.PACKET_POKER_PLAYER_INFO)
+    def handlePacketPokerPlayerInfo(self, packet):
+        self.updatePlayer(packet.__dict__)
+
+    @handles(networkpackets.PACKET_POKER_PLAYER_ARRIVE)
+    def handlePacketPokerPlayerArrive(self, packet):
+        self.updatePlayer(packet.__dict__)
+
+    @handles(networkpackets.PACKET_POKER_PLAYER_CHIPS)
+    def handlePacketPokerPlayerChips(self, packet):
+        return self.updatePlayerChips(packet.serial, chips=packet.money, bet=packet.bet)
+
+    @handles(networkpackets.PACKET_POKER_PLAYER_LEAVE)
+    def handlePacketPokerPlayerLeave(self, packet):
+        self.removePlayer(packet.seat)
+
+    @handles(networkpackets.PACKET_POKER_SIT)
+    def handlePacketPokerSit(self, packet):
+        self._get_player(packet.serial).sit()
+
+    @handles(networkpackets.PACKET_POKER_SIT_OUT)
+    def handlePacketPokerSitOut(self, packet):
+        self._get_player(packet.serial).sitOut()
+
+    @handles(networkpackets.PACKET_POKER_REBUY)
+    def handlePacketPokerRebuy(self, packet):
+        assert self.id == packet.game_id
+        self.rebuy(packet.serial, packet.amount)
+
+    @handles(networkpackets.PACKET_POKER_IN_GAME)
+    def handlePacketPokerInGame(self, packet):
+        assert self.id == packet.game_id
+        self._setInGame(packet.players)
+
+    @handles(networkpackets.PACKET_POKER_POSITION)
+    def handlePacketPokerPosition(self, packet):
+        assert self.id == packet.game_id
+        self.position = packet.position
+
+    @handles(networkpackets.PACKET_POKER_START)
+    def handlePacketPokerStart(self, packet):
+        assert self.id == packet.game_id
+        self.reset()
+        self.hand_serial = packet.hand_serial
+
+    @handles(networkpackets.PACKET_POKER_DEALER)
+    def handlePacketPokerDealer(self, packet):
+        assert self.id == packet.game_id
+        # assert self.dealer == packet.previous_dealer
+        self.dealer = packet.dealer
+
+    @handles(networkpackets.PACKET_POKER_PLAYER_CARDS)
+    def handlePacketPokerPlayerCards(self, packet):
+        self.updatePlayerCards(packet.serial, packet.cards)
+        if packet.serial == self.avatar.serial:
+            self.logIt("You got %r" % self._cards_to_string(packet.cards))
+
+    @handles(networkpackets.PACKET_POKER_BOARD_CARDS)
+    def handlePacketPokerBoardCards(self, packet):
+        self.board_cards = packet.cards
+
+    @handles(networkpackets.PACKET_POKER_RAISE)
+    def handlePacketPokerRaise(self, packet):
+        self._bet(self._get_player(packet.serial), packet.amount)
+
+    @handles(networkpackets.PACKET_POKER_CALL)
+    def handlePacketPokerCall(self, packet):
+        player = self._get_player(packet.serial)
+        highestbet = self.highestBetNotFold()
+        bigb =self.bigBlind() if self._game_state == GAME_STATE_PRE_FLOP and not self.inSmallBlindPosition() else 0
+        self.logIt("%r, %r" % (highestbet,bigb))
+        # a player without enough chips calls all in
+        amount = min(
+            max(highestbet,bigb) - player._bet,
+            player._chips
+        )
+        self._bet(player, amount)
+
+    @handles(networkpackets.PACKET_POKER_FOLD)
+    def handlePacketPokerFold(self, packet):
+        self._fold(packet.serial)
+
+    @handles(networkpackets.PACKET_POKER_STATE)
+    def handlePacketPokerState(self, packet):
+        self._game_state = packet.string
+
+    @handles(networkpackets.PACKET_POKER_BLIND)
+    def handlePacketPokerBlind(self, packet):
+        self._bet(self._get_player(packet.serial), packet.amount)
 
-        try:
-            handle = locals()["handle"+packet.__class__.__name__]
-            return handle(packet)
-        except KeyError:
-            # self.logIt(" explain cant handle : %r" % packet.__class__.__name__)
+    def explain(self, packet, state):
+        """packets that might be interesting for the game will be handled here, returns True if the packet was not handled"""
+        handler = self._handlers.get(packet.type)
+        if handler is None:
             return True
+        # every handler changes the state of the table
+        self.version += 1
+        try:
+            return handler(self, packet)
         except Exception:
             exc_type, exc_value, exc_traceback = sys.exc_info()
             self.logIt(packet.__class__.__name__, prefix=" EEE  handle failed: ")
@@ -391,7 +568,7 @@ class Table(object):
 
     def _cards_to_string(self, cards):
         """return a string for cards in a human readable way"""
-        return repr(self._eval.card2string(map(lambda x: x & 63, cards)))\
+        return repr(self._eval.cardsToString(cards))\
             #.lower().replace("h", u"\u2761").replace("s", u"\u2660").replace("c", u"\u2663").replace("d", u"\u2662")
     def _get_or_create_player(self, serial, seat=None, **player_info):
         """returns the player with the serial, the player will be created if it does not exist yet"""
@@ -420,8 +597,13 @@ class Table(object):
 
     
     def getDebugLines(self):
-        """returns a list of debug lines (yellow box)"""
-        return self._get_table_info() + self._get_avatar_info() + self._get_player_info()
+        """returns a list of debug lines (yellow box), they are only built again if the state changed"""
+        debug_version = self.version, tuple(sorted(self.avatar.money.iteritems()))
+        if self._debug_version != debug_version:
+            self._estimateMissingEquity()
+            self._debug_lines = self._get_table_info() + self._get_avatar_info() + self._get_player_info()
+            self._debug_version = debug_version
+        return self._debug_lines
 
     @catcher
     def _get_table_info(self):
@@ -446,8 +628,27 @@ class Table(object):
         if self.board_cards:
             retvals.append("board: " + self._cards_to_string(self.board_cards))
             if self.avatar.cards:
-                best_hand = self._eval.best_hand("hi", self.avatar.getCards() + self.getBoardCards())
+                best_hand = self._eval.bestHand(self.avatar.getCards() + self.getBoardCards())
                 desc = best_hand.pop(0)
                 retvals.append("%s: %s" % (desc, self._cards_to_string(best_hand)))
+        if len(self.avatar.cards) == 2:
+            opponents = self.opponents()
+            preflop_equity = self.preflopEquity(opponents)
+            if preflop_equity is not None:
+                retvals.append("preflop equity vs %d: %.1f%%" % (opponents, preflop_equity * 100))
+            equity = self._equity.cached(self.avatar.getCards(), self.getBoardCards(), opponents)
+            if equity is not None:
+                retvals.append("equity vs %d: %s" % (opponents, equity))
+            elif self._equity.isPending(self.avatar.getCards(), self.getBoardCards(), opponents):
+                retvals.append("equity vs %d: ..." % opponents)
         return retvals
 
+    def _estimateMissingEquity(self):
+        """starts the estimation of the avatar equity for the debug lines if it is not cached, shown as soon as it is ready"""
+        if len(self.avatar.cards) != 2 or not self._equity.isAvailable():
+            return
+        opponents = self.opponents()
+        if self._equity.cached(self.avatar.getCards(), self.getBoardCards(), opponents) is None:
+            self.estimateEquity(opponents).addErrback(
+                lambda reason: self.logIt(reason.getErrorMessage(), prefix=" EEE  equity failed: "))
+
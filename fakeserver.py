@@ -0,0 +1,535 @@
+#!/usr/bin/env python
+"""
+stand-in poker server for benchmarks and soak tests on one machine
+
+Speaks the pokerpackets protocol of pokernetwork (the connection is a
+UGAMEProtocol like the one of the real server) and plays no-limit holdem on a
+few tables: login, table list, join, seat, buy-in, blinds, dealing, betting
+rounds and showdown. Empty seats can be taken by robots that act at random or
+always call. It is a stand-in, not a referee: there are no side pots, an all in
+player who wins takes the whole pot.
+
+    python fakeserver.py [--port 19380] [--tables 2] [--seats 10] [--robots 2] [--robot-style random|call]
+
+Amounts are in cents, like the ones of the real server.
+"""
+import sys, random
+from twisted.internet import reactor, protocol
+from pokernetwork.protocol import UGAMEProtocol
+from pokerpackets import packets, networkpackets
+from pokereval import PokerEval
+
+from explain import GAME_STATE_BLIND_ANTE, GAME_STATE_PRE_FLOP, GAME_STATE_FLOP, \
+    GAME_STATE_TURN, GAME_STATE_RIVER, GAME_STATE_END
+
+# cards of the other players are sent like this
+UNKNOWN_CARD = 255
+ANY_SEAT = 255
+# currency of the play money
+CURRENCY = 1
+# (state, board cards dealt at the start of the round)
+ROUNDS = ((GAME_STATE_PRE_FLOP, 0), (GAME_STATE_FLOP, 3), (GAME_STATE_TURN, 1), (GAME_STATE_RIVER, 1))
+
+
+class Seat(object):
+    """a player sitting at a table, connection is None for robots and players that lost their connection"""
+
+    def __init__(self, serial, name, seat, connection=None, robot=False):
+        self.serial = serial
+        self.name = name
+        self.seat = seat
+        self.connection = connection
+        self.robot = robot
+        self.chips = 0
+        self.bet = 0
+        self.sitting = False
+        self.cards = []
+
+
+class FakeTable(object):
+    """one table, plays hands as long as two players with chips sit at it"""
+
+    small_blind = 100
+    big_blind = 200
+    min_buy_in = 1000
+    max_buy_in = 10000
+    betting_structure = "1-2_10-100_no-limit"
+    # seconds between two hands / a robot thinks / a player may think before they are folded
+    hand_delay = 1.0
+    robot_delay = 0.2
+    player_timeout = 30.0
+
+    def __init__(self, server, game_id, name, seats=10):
+        self.server = server
+        self.game_id = game_id
+        self.name = name
+        # serial of the player or 0 for every seat
+        self.seats = [0] * seats
+        # serial: Seat
+        self.players = {}
+        # connections that joined the table
+        self.observers = set()
+        self.dealer = -1
+        self.hand_serial = None
+        self.in_game = []
+        self.position = -1
+        # players that quit during a hand, they leave at its end
+        self._leaving = set()
+        self._eval = PokerEval()
+        self._hand_call = None
+        self._turn_call = None
+
+    def tableInfo(self, serial=None):
+        seated = self.players[serial].seat if serial in self.players else -1
+        return networkpackets.PacketPokerTable(id=self.game_id, name=self.name, seats=len(self.seats),
+            players=len(self.players), betting_structure=self.betting_structure, player_seated=seated)
+
+    def broadcast(self, packet):
+        for connection in list(self.observers):
+            connection.sendPacket(packet)
+
+    def _chips(self, player):
+        self.broadcast(networkpackets.PacketPokerPlayerChips(game_id=self.game_id, serial=player.serial,
+            money=player.chips, bet=player.bet))
+
+    # players
+
+    def join(self, connection):
+        """send the state of the table to a connection that joined"""
+        self.observers.add(connection)
+        send = connection.sendPacket
+        send(self.tableInfo(connection.serial))
+        send(networkpackets.PacketPokerBuyInLimits(game_id=self.game_id, min=self.min_buy_in, max=self.max_buy_in,
+            best=self.max_buy_in, rebuy_min=self.min_buy_in))
+        send(networkpackets.PacketPokerSeats(game_id=self.game_id, seats=self.seats))
+        for player in self.players.itervalues():
+            send(networkpackets.PacketPokerPlayerArrive(game_id=self.game_id, serial=player.serial, name=player.name, seat=player.seat))
+            send(networkpackets.PacketPokerPlayerChips(game_id=self.game_id, serial=player.serial, money=player.chips, bet=player.bet))
+            if player.sitting:
+                send(networkpackets.PacketPokerSit(game_id=self.game_id, serial=player.serial))
+        if connection.serial in self.players:
+            # the player is back
+            self.players[connection.serial].connection = connection
+        if self.in_game:
+            self._sendHand(connection)
+
+    def _sendHand(self, connection):
+        """send the state of the hand that is played to a connection that joined during the hand"""
+        send = connection.sendPacket
+        send(networkpackets.PacketPokerStart(game_id=self.game_id, hand_serial=self.hand_serial))
+        send(networkpackets.PacketPokerInGame(game_id=self.game_id, players=self.in_game))
+        send(networkpackets.PacketPokerDealer(game_id=self.game_id, dealer=self.dealer, previous_dealer=self.dealer))
+        send(networkpackets.PacketPokerState(game_id=self.game_id, string=self.state))
+        for serial in self.in_game:
+            player = self.players[serial]
+            # the start of the hand reset the bets
+            send(networkpackets.PacketPokerPlayerChips(game_id=self.game_id, serial=serial, money=player.chips, bet=player.bet))
+            cards = player.cards if connection.serial == serial else [UNKNOWN_CARD] * len(player.cards)
+            send(networkpackets.PacketPokerPlayerCards(game_id=self.game_id, serial=serial, cards=cards))
+        if self.board:
+            send(networkpackets.PacketPokerBoardCards(game_id=self.game_id, cards=self.board))
+        for serial in self.in_game:
+            if serial in self.folded:
+                send(networkpackets.PacketPokerFold(game_id=self.game_id, serial=serial))
+        if self.position >= 0:
+            serial = self.in_game[self.position]
+            send(networkpackets.PacketPokerPosition(game_id=self.game_id, serial=serial, position=self.position))
+
+    def leave(self, connection):
+        """the connection is gone, its player stays seated until the player quits"""
+        self.observers.discard(connection)
+        player = self.players.get(connection.serial)
+        if player is not None and player.connection is connection:
+            player.connection = None
+            player.sitting = False
+            if self.isTurnOf(player.serial):
+                self._act(player, networkpackets.PACKET_POKER_FOLD)
+
+    def seat(self, serial, name, seat, connection=None, robot=False):
+        """returns the Seat of the player or None if the seat is taken (or the table is full)"""
+        if serial in self.players:
+            return self.players[serial]
+        if seat == ANY_SEAT or not 0 <= seat < len(self.seats) or self.seats[seat]:
+            free = [index for index, occupant in enumerate(self.seats) if not occupant]
+            if not free:
+                return None
+            seat = free[0]
+        player = self.players[serial] = Seat(serial, name, seat, connection, robot)
+        self.seats[seat] = serial
+        self.broadcast(networkpackets.PacketPokerPlayerArrive(game_id=self.game_id, serial=serial, name=name, seat=seat))
+        self.broadcast(networkpackets.PacketPokerSeats(game_id=self.game_id, seats=self.seats))
+        return player
+
+    def buyIn(self, serial, amount):
+        player = self.players.get(serial)
+        if player is None or serial in self.in_game:
+            return
+        player.chips = max(player.chips, min(max(amount, self.min_buy_in), self.max_buy_in))
+        self._chips(player)
+
+    def rebuy(self, serial, amount):
+        player = self.players.get(serial)
+        if player is None or serial in self.in_game:
+            return
+        amount = max(0, min(amount, self.max_buy_in - player.chips))
+        player.chips += amount
+        self.broadcast(networkpackets.PacketPokerRebuy(game_id=self.game_id, serial=serial, amount=amount))
+        self._chips(player)
+
+    def sit(self, serial):
+        player = self.players.get(serial)
+        if player is None:
+            return
+        player.sitting = True
+        self.broadcast(networkpackets.PacketPokerSit(game_id=self.game_id, serial=serial))
+        self.scheduleHand()
+
+    def sitOut(self, serial):
+        player = self.players.get(serial)
+        if player is None:
+            return
+        player.sitting = False
+        self.broadcast(networkpackets.PacketPokerSitOut(game_id=self.game_id, serial=serial))
+
+    def quit(self, serial):
+        player = self.players.get(serial)
+        if player is None:
+            return
+        if serial in self.in_game:
+            self._leaving.add(serial)
+            if self.isTurnOf(serial):
+                self._act(player, networkpackets.PACKET_POKER_FOLD)
+            elif serial not in self.folded:
+                # the turn stays where it is
+                self._fold(player)
+            return
+        self._remove(player)
+
+    def _remove(self, player):
+        del self.players[player.serial]
+        self.seats[player.seat] = 0
+        self.broadcast(networkpackets.PacketPokerPlayerLeave(game_id=self.game_id, serial=player.serial, seat=player.seat))
+
+    # hands
+
+    def scheduleHand(self):
+        if self._hand_call is None and not self.in_game:
+            self._hand_call = reactor.callLater(self.hand_delay, self.startHand)
+
+    def _state(self, state):
+        self.state = state
+        self.broadcast(networkpackets.PacketPokerState(game_id=self.game_id, string=state))
+
+    def startHand(self):
+        self._hand_call = None
+        for player in self.players.values():
+            if player.robot and player.chips < self.big_blind:
+                self.buyIn(player.serial, self.max_buy_in)
+        ready = [self.players[serial] for serial in self.seats
+                 if serial and self.players[serial].sitting and self.players[serial].chips > 0]
+        if len(ready) < 2:
+            return
+        self.hand_serial = self.server.nextHandSerial()
+        self.in_game = [player.serial for player in ready]
+        self.folded = set()
+        self.board = []
+        self.pot = 0
+        previous_dealer, self.dealer = self.dealer, (self.dealer + 1) % len(self.in_game)
+        self.broadcast(networkpackets.PacketPokerStart(game_id=self.game_id, hand_serial=self.hand_serial))
+        self.broadcast(networkpackets.PacketPokerInGame(game_id=self.game_id, players=self.in_game))
+        self.broadcast(networkpackets.PacketPokerDealer(game_id=self.game_id, dealer=self.dealer, previous_dealer=previous_dealer))
+        self._state(GAME_STATE_BLIND_ANTE)
+        for player in ready:
+            player.bet = 0
+        self.highest = 0
+        for offset, blind in ((1, self.small_blind), (2, self.big_blind)):
+            player = ready[(self.dealer + offset) % len(ready)]
+            amount = min(blind, player.chips)
+            player.chips -= amount
+            player.bet += amount
+            self.highest = max(self.highest, player.bet)
+            self.broadcast(networkpackets.PacketPokerBlind(game_id=self.game_id, serial=player.serial, amount=amount))
+            self._chips(player)
+        self.min_raise = self.big_blind
+        self.deck = range(52)
+        random.shuffle(self.deck)
+        for player in ready:
+            player.cards = [self.deck.pop(), self.deck.pop()]
+        for connection in list(self.observers):
+            for player in ready:
+                cards = player.cards if connection.serial == player.serial else [UNKNOWN_CARD] * len(player.cards)
+                connection.sendPacket(networkpackets.PacketPokerPlayerCards(game_id=self.game_id, serial=player.serial, cards=cards))
+        self._state(GAME_STATE_PRE_FLOP)
+        self.round = 0
+        # preflop the player behind the big blind starts
+        self._startRound((self.dealer + 3) % len(self.in_game))
+
+    def _active(self):
+        """players that can still act"""
+        return [serial for serial in self.in_game if serial not in self.folded and self.players[serial].chips > 0]
+
+    def _startRound(self, first):
+        self.acted = set()
+        self.position = first - 1
+        self._nextTurn()
+
+    def isTurnOf(self, serial):
+        return bool(self.in_game) and self.position >= 0 and self.in_game[self.position] == serial
+
+    def _roundDone(self):
+        for serial in self._active():
+            if serial not in self.acted or self.players[serial].bet < self.highest:
+                return False
+        return True
+
+    def _nextTurn(self):
+        if len(self.in_game) - len(self.folded) < 2:
+            return self._endHand()
+        if self._roundDone():
+            return self._nextRound()
+        for step in range(1, len(self.in_game) + 1):
+            position = (self.position + step) % len(self.in_game)
+            if self.in_game[position] in self._active():
+                break
+        self.position = position
+        player = self.players[self.in_game[position]]
+        self.broadcast(networkpackets.PacketPokerPosition(game_id=self.game_id, serial=player.serial, position=position))
+        if player.robot:
+            self._turn_call = reactor.callLater(self.robot_delay, self._robotAction, player)
+        elif player.connection is None:
+            # the player is gone
+            self._turn_call = reactor.callLater(0, self._act, player, networkpackets.PACKET_POKER_FOLD)
+        else:
+            self._turn_call = reactor.callLater(self.player_timeout, self._act, player, networkpackets.PACKET_POKER_FOLD)
+
+    def _nextRound(self):
+        for serial in self.in_game:
+            player = self.players[serial]
+            self.pot += player.bet
+            if player.bet:
+                player.bet = 0
+                self._chips(player)
+        self.highest = 0
+        self.min_raise = self.big_blind
+        self.round += 1
+        if self.round == len(ROUNDS):
+            return self._endHand()
+        state, cards = ROUNDS[self.round]
+        self._state(state)
+        self.board += [self.deck.pop() for _ in range(cards)]
+        self.broadcast(networkpackets.PacketPokerBoardCards(game_id=self.game_id, cards=self.board))
+        if len(self._active()) < 2:
+            # everybody is all in, the board is dealt without betting
+            return self._nextRound()
+        self._startRound((self.dealer + 1) % len(self.in_game))
+
+    def action(self, serial, packet_type, amount=0):
+        """an action of a player, actions of players that are not in turn are ignored"""
+        if not self.isTurnOf(serial):
+            return
+        self._act(self.players[serial], packet_type, amount)
+
+    def _act(self, player, packet_type, amount=0):
+        if self._turn_call is not None and self._turn_call.active():
+            self._turn_call.cancel()
+        self._turn_call = None
+        to_call = min(self.highest - player.bet, player.chips)
+        if packet_type == networkpackets.PACKET_POKER_CHECK and to_call > 0:
+            packet_type = networkpackets.PACKET_POKER_CALL
+        if packet_type == networkpackets.PACKET_POKER_RAISE and player.chips <= to_call:
+            packet_type = networkpackets.PACKET_POKER_CALL
+        if packet_type == networkpackets.PACKET_POKER_CALL and to_call == 0:
+            packet_type = networkpackets.PACKET_POKER_CHECK
+        echo = dict(game_id=self.game_id, serial=player.serial)
+        if packet_type == networkpackets.PACKET_POKER_FOLD:
+            self._fold(player)
+        elif packet_type == networkpackets.PACKET_POKER_CHECK:
+            self.broadcast(networkpackets.PacketPokerCheck(**echo))
+        else:
+            put = to_call
+            if packet_type == networkpackets.PACKET_POKER_RAISE:
+                raise_by = max(amount - to_call, self.min_raise)
+                put = min(to_call + raise_by, player.chips)
+                self.min_raise = max(self.min_raise, put - to_call)
+                # everybody has to act again
+                self.acted = set()
+            player.chips -= put
+            player.bet += put
+            self.highest = max(self.highest, player.bet)
+            if packet_type == networkpackets.PACKET_POKER_RAISE:
+                self.broadcast(networkpackets.PacketPokerRaise(amount=put, **echo))
+            else:
+                self.broadcast(networkpackets.PacketPokerCall(**echo))
+            self._chips(player)
+        self.acted.add(player.serial)
+        self._nextTurn()
+
+    def _fold(self, player):
+        self.folded.add(player.serial)
+        self.broadcast(networkpackets.PacketPokerFold(game_id=self.game_id, serial=player.serial))
+
+    def _robotAction(self, player):
+        self._turn_call = None
+        rand = random.random() if self.server.robot_style == "random" else 1.0
+        if rand < 0.15:
+            self._act(player, networkpackets.PACKET_POKER_RAISE, self.big_blind * random.randint(1, 5))
+        elif rand < 0.3:
+            self._act(player, networkpackets.PACKET_POKER_FOLD)
+        else:
+            self._act(player, networkpackets.PACKET_POKER_CALL)
+
+    def _endHand(self):
+        for serial in self.in_game:
+            self.pot += self.players[serial].bet
+            self.players[serial].bet = 0
+        remaining = [serial for serial in self.in_game if serial not in self.folded]
+        if len(remaining) > 1:
+            self.board += [self.deck.pop() for _ in range(5 - len(self.board))]
+            for serial in remaining:
+                self.broadcast(networkpackets.PacketPokerPlayerCards(game_id=self.game_id, serial=serial, cards=self.players[serial].cards))
+            result = self._eval.winners(game="holdem", pockets=[self.players[serial].cards for serial in remaining], board=self.board)
+            winners = [remaining[index] for index in result["hi"]]
+        else:
+            winners = remaining
+        if winners:
+            share, odd = divmod(self.pot, len(winners))
+            for index, serial in enumerate(winners):
+                self.players[serial].chips += share + (index < odd)
+        self.broadcast(networkpackets.PacketPokerWin(game_id=self.game_id, serials=winners))
+        for serial in self.in_game:
+            self._chips(self.players[serial])
+        self._state(GAME_STATE_END)
+        self.in_game = []
+        self.position = -1
+        for serial in self._leaving:
+            self._remove(self.players[serial])
+        self._leaving.clear()
+        self.scheduleHand()
+
+
+class FakeServerProtocol(UGAMEProtocol):
+    """connection of one client"""
+
+    def __init__(self):
+        UGAMEProtocol.__init__(self)
+        self.serial = None
+        self.name = None
+        self.tables = {}
+
+    def _handleConnection(self, packet):
+        self.factory.handlePacket(self, packet)
+
+    def connectionLost(self, reason):
+        for table in self.tables.values():
+            table.leave(self)
+        UGAMEProtocol.connectionLost(self, reason)
+
+
+class FakeServerFactory(protocol.ServerFactory):
+    """the tables and players of the server"""
+
+    protocol = FakeServerProtocol
+
+    def __init__(self, tables=2, seats=10, robots=2, robot_style="random"):
+        self.robot_style = robot_style
+        self.tables = {}
+        # name: serial
+        self.serials = {}
+        self._hand_serial = 0
+        for game_id in range(1, tables + 1):
+            table = self.tables[game_id] = FakeTable(self, game_id, "Fake%d" % game_id, seats)
+            for index in range(robots):
+                serial = self.login("ROBOT%d_%d" % (game_id, index))
+                table.seat(serial, "ROBOT%d_%d" % (game_id, index), ANY_SEAT, robot=True)
+                table.buyIn(serial, table.max_buy_in)
+                table.sit(serial)
+
+    def buildProtocol(self, addr):
+        instance = self.protocol()
+        instance.factory = self
+        return instance
+
+    def login(self, name):
+        """returns the serial of the name, every name gets one when it logs in the first time"""
+        if name not in self.serials:
+            self.serials[name] = len(self.serials) + 1
+        return self.serials[name]
+
+    def nextHandSerial(self):
+        self._hand_serial += 1
+        return self._hand_serial
+
+    def handlePacket(self, connection, packet):
+        send = connection.sendPacket
+        if packet.type in (packets.PACKET_LOGIN, packets.PACKET_AUTH):
+            # every password and auth key is fine
+            connection.name = getattr(packet, "name", None) or "user%s" % packet.auth
+            connection.serial = self.login(connection.name)
+            send(packets.PacketAuthOk())
+            send(packets.PacketSerial(serial=connection.serial))
+            return
+        if connection.serial is None:
+            send(packets.PacketAuthRefused())
+            return
+        if packet.type == networkpackets.PACKET_POKER_GET_PLAYER_INFO:
+            send(networkpackets.PacketPokerPlayerInfo(serial=connection.serial, name=connection.name))
+        elif packet.type == networkpackets.PACKET_POKER_GET_USER_INFO:
+            send(networkpackets.PacketPokerUserInfo(serial=packet.serial, name=connection.name, money={CURRENCY: (10000000, 0, 0)}))
+        elif packet.type == networkpackets.PACKET_POKER_TABLE_SELECT:
+            send(networkpackets.PacketPokerTableList(packets=[table.tableInfo() for _, table in sorted(self.tables.iteritems())]))
+        elif packet.type == networkpackets.PACKET_POKER_TABLE_JOIN:
+            table = self.tables.get(packet.game_id)
+            if table is not None:
+                connection.tables[table.game_id] = table
+                table.join(connection)
+        elif packet.type in (networkpackets.PACKET_POKER_CALL, networkpackets.PACKET_POKER_RAISE,
+                             networkpackets.PACKET_POKER_FOLD, networkpackets.PACKET_POKER_CHECK):
+            table = connection.tables.get(packet.game_id)
+            if table is not None:
+                table.action(connection.serial, packet.type, getattr(packet, "amount", 0))
+        else:
+            table = connection.tables.get(getattr(packet, "game_id", None))
+            if table is None:
+                return
+            if packet.type == networkpackets.PACKET_POKER_SEAT:
+                table.seat(connection.serial, connection.name, packet.seat, connection)
+            elif packet.type == networkpackets.PACKET_POKER_BUY_IN:
+                table.buyIn(connection.serial, packet.amount)
+            elif packet.type == networkpackets.PACKET_POKER_REBUY:
+                table.rebuy(connection.serial, packet.amount)
+            elif packet.type == networkpackets.PACKET_POKER_SIT:
+                table.sit(connection.serial)
+            elif packet.type == networkpackets.PACKET_POKER_SIT_OUT:
+                table.sitOut(connection.serial)
+            elif packet.type == networkpackets.PACKET_POKER_TABLE_QUIT:
+                table.quit(connection.serial)
+                table.observers.discard(connection)
+                del connection.tables[table.game_id]
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="stand-in poker server")
+    parser.add_argument("--port", type=int, default=19380)
+    parser.add_argument("--interface", default="127.0.0.1")
+    parser.add_argument("--tables", type=int, default=2)
+    parser.add_argument("--seats", type=int, default=10)
+    parser.add_argument("--robots", type=int, default=2, help="robots sitting at every table")
+    parser.add_argument("--robot-style", choices=("random", "call"), default="random")
+    parser.add_argument("--hand-delay", type=float, default=FakeTable.hand_delay, help="seconds between two hands")
+    parser.add_argument("--robot-delay", type=float, default=FakeTable.robot_delay, help="seconds a robot thinks")
+    parser.add_argument("--player-timeout", type=float, default=FakeTable.player_timeout, help="seconds before a player is folded")
+    args = parser.parse_args(argv)
+
+    FakeTable.hand_delay = args.hand_delay
+    FakeTable.robot_delay = args.robot_delay
+    FakeTable.player_timeout = args.player_timeout
+    factory = FakeServerFactory(args.tables, args.seats, args.robots, args.robot_style)
+    reactor.listenTCP(args.port, factory, interface=args.interface)
+    print "fake server with %d tables on %s:%d" % (args.tables, args.interface, args.port)
+    reactor.run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
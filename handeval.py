@@ -0,0 +1,91 @@
+"""
+process wide hand evaluation
+
+All tables, bots and analytics of a process share one PokerEval. Results are
+kept in bounded LRU caches keyed on the canonical card set, so evaluating the
+same hole and board cards again (e.g. on every repaint of a street) is a dict hit.
+"""
+from collections import OrderedDict
+from pokereval import PokerEval
+
+_evaluator = None
+
+
+class LRUCache(object):
+    """mapping with a maximal size, the least recently used entries are dropped first"""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """returns the cached value and marks it as recently used, counts hits and misses"""
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        """drop all entries and reset the counters"""
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class HandEvaluator(object):
+    """PokerEval with cached results, use getEvaluator() to get the one of the process"""
+
+    def __init__(self, maxsize=10000):
+        self.pokereval = PokerEval()
+        self._best_hands = LRUCache(maxsize)
+        self._strings = LRUCache(maxsize)
+
+    def bestHand(self, cards, side="hi"):
+        """returns [description, card, ...] of the best hand that can be made of the cards"""
+        # the best hand does not depend on the order of the cards
+        key = (side, tuple(sorted(cards)))
+        best_hand = self._best_hands.get(key)
+        if best_hand is None:
+            best_hand = self.pokereval.best_hand(side, list(cards))
+            self._best_hands[key] = best_hand
+        # callers may modify the result (e.g. pop the description)
+        return list(best_hand)
+
+    def cardsToString(self, cards):
+        """returns the cards (without visibility bits) as list of strings, e.g. ['Ah', 'Td']"""
+        key = tuple(card & 63 for card in cards)
+        strings = self._strings.get(key)
+        if strings is None:
+            strings = self.pokereval.card2string(list(key))
+            self._strings[key] = strings
+        return list(strings)
+
+    def stats(self):
+        """returns a dict with hits, misses and size of every cache"""
+        return dict(
+            (name, dict(hits=cache.hits, misses=cache.misses, size=len(cache)))
+            for name, cache in (("best_hand", self._best_hands), ("card2string", self._strings))
+        )
+
+
+def getEvaluator():
+    """returns the evaluator shared by the whole process"""
+    global _evaluator
+    if _evaluator is None:
+        _evaluator = HandEvaluator()
+    return _evaluator
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+on-disk index of the hands in packet logs
+
+For every PacketPokerStart the index records the log file, the byte offset of
+the line, the hand_serial, the table (game_id) and the serials that took part
+(PacketPokerInGame). Indexing a file again only reads what was appended since,
+queries seek straight to the hands in the logs.
+
+    python handindex.py index <index> <log file or directory> ...
+    python handindex.py query <index> [--player serial] [--table game_id] [--hand hand_serial] [--show]
+"""
+import os, re, sys, sqlite3
+
+import replay
+from pokerpackets import networkpackets
+from explain import GAME_STATE_END
+
+_START = "> POKER_START "
+_IN_GAME = "> POKER_IN_GAME "
+_STATE = "> POKER_STATE "
+_WIN = "> POKER_WIN "
+_GAME_ID = re.compile(r"\bgame_id = (\d+)\b")
+
+_SCHEMA = """
+create table if not exists files (
+    id integer primary key,
+    path text unique,
+    indexed_to integer not null
+);
+create table if not exists hands (
+    id integer primary key,
+    file_id integer not null,
+    offset integer not null,
+    hand_serial integer not null,
+    game_id integer not null,
+    unique (file_id, offset)
+);
+create table if not exists hand_players (
+    hand_id integer not null,
+    serial integer not null,
+    primary key (hand_id, serial)
+);
+create index if not exists hands_by_serial on hands (hand_serial);
+create index if not exists hands_by_game on hands (game_id);
+create index if not exists players_by_serial on hand_players (serial);
+"""
+
+
+class HandIndex(object):
+    """sqlite index of the hands of many log files"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._db = sqlite3.connect(filename)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def _file(self, path):
+        """returns (id, indexed_to) of the file, it is added if it is not known yet"""
+        row = self._db.execute("select id, indexed_to from files where path = ?", (path,)).fetchone()
+        if row is None:
+            cursor = self._db.execute("insert into files (path, indexed_to) values (?, 0)", (path,))
+            row = cursor.lastrowid, 0
+        return row
+
+    def _dropHands(self, file_id, offset=0):
+        """remove the hands of the file at or behind the offset"""
+        self._db.execute("delete from hand_players where hand_id in (select id from hands where file_id = ? and offset >= ?)", (file_id, offset))
+        self._db.execute("delete from hands where file_id = ? and offset >= ?", (file_id, offset))
+
+    def indexFile(self, path):
+        """index the part of the file that was not indexed yet, returns the number of hands found"""
+        path = os.path.abspath(path)
+        file_id, indexed_to = self._file(path)
+        if os.path.getsize(path) < indexed_to:
+            # the file was truncated or replaced
+            indexed_to = 0
+        # the last hand may have been incomplete, it is indexed again
+        self._dropHands(file_id, indexed_to)
+        # game_id: (id, offset) of the hand of the table that did not end yet
+        current = {}
+        # game_id: offset of the last line of the table
+        last_line = {}
+        last_start = 0
+        found = 0
+        offset = indexed_to
+        line = ""
+        with open(path, "rb") as fd:
+            fd.seek(offset)
+            for line in iter(fd.readline, ""):
+                line_offset, offset = offset, offset + len(line)
+                if line.startswith(_START):
+                    packet = self._parse(line)
+                    if packet is None:
+                        continue
+                    cursor = self._db.execute("insert into hands (file_id, offset, hand_serial, game_id) values (?, ?, ?, ?)",
+                        (file_id, line_offset, packet.hand_serial, packet.game_id))
+                    current[packet.game_id] = cursor.lastrowid, line_offset
+                    last_line[packet.game_id] = last_start = line_offset
+                    found += 1
+                elif line.startswith(_IN_GAME):
+                    packet = self._parse(line)
+                    if packet is None or packet.game_id not in current:
+                        continue
+                    last_line[packet.game_id] = line_offset
+                    self._db.executemany("insert or ignore into hand_players (hand_id, serial) values (?, ?)",
+                        [(current[packet.game_id][0], serial) for serial in packet.players])
+                elif line.startswith(_WIN) or line.startswith(_STATE):
+                    packet = self._parse(line)
+                    if packet is None:
+                        continue
+                    if packet.type == networkpackets.PACKET_POKER_WIN or packet.string == GAME_STATE_END:
+                        # the hand is complete
+                        current.pop(packet.game_id, None)
+                    else:
+                        last_line[packet.game_id] = line_offset
+                else:
+                    match = _GAME_ID.search(line)
+                    if match is not None:
+                        last_line[int(match.group(1))] = line_offset
+        # a half written last line is read again next time
+        if not line.endswith("\n"):
+            offset -= len(line)
+        # hands that did not end may go on and are indexed again next time, unless the table
+        # got no packets since a later hand started (it was left)
+        open_hands = [hand_offset for game_id, (_, hand_offset) in current.iteritems() if last_line[game_id] >= last_start]
+        if open_hands:
+            offset = min(open_hands)
+        self._db.execute("update files set indexed_to = ? where id = ?", (offset, file_id))
+        self._db.commit()
+        return found
+
+    def _parse(self, line):
+        try:
+            return replay.parseLine(line.rstrip("\r\n"))[1]
+        except Exception:
+            return None
+
+    def query(self, player=None, table=None, hand=None):
+        """yields (path, offset, hand_serial, game_id, serials) of the matching hands"""
+        where, params = [], []
+        if player is not None:
+            where.append("hands.id in (select hand_id from hand_players where serial = ?)")
+            params.append(player)
+        if table is not None:
+            where.append("hands.game_id = ?")
+            params.append(table)
+        if hand is not None:
+            where.append("hands.hand_serial = ?")
+            params.append(hand)
+        sql = "select hands.id, files.path, hands.offset, hands.hand_serial, hands.game_id from hands join files on files.id = hands.file_id"
+        if where:
+            sql += " where " + " and ".join(where)
+        sql += " order by files.path, hands.offset"
+        for hand_id, path, offset, hand_serial, game_id in self._db.execute(sql, params).fetchall():
+            serials = [serial for serial, in self._db.execute("select serial from hand_players where hand_id = ? order by serial", (hand_id,))]
+            yield path, offset, hand_serial, game_id, serials
+
+
+def iterHandLines(path, offset, game_id):
+    """yields the lines of the hand starting at offset, lines of other tables are skipped"""
+    same_game = re.compile(r"\bgame_id = %d\b" % game_id)
+    with open(path, "rb") as fd:
+        fd.seek(offset)
+        first = True
+        for line in iter(fd.readline, ""):
+            if not same_game.search(line):
+                continue
+            if line.startswith(_START) and not first:
+                break
+            first = False
+            yield line.rstrip("\r\n")
+
+def iterLogFiles(paths):
+    """yields the files and the files in the directories (recursively)"""
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    yield os.path.join(dirpath, filename)
+        else:
+            yield path
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="index hands of packet logs and query the index")
+    commands = parser.add_subparsers(dest="command")
+    index_parser = commands.add_parser("index", help="index new hands of log files")
+    index_parser.add_argument("index")
+    index_parser.add_argument("logs", nargs="+")
+    query_parser = commands.add_parser("query", help="list the matching hands")
+    query_parser.add_argument("index")
+    query_parser.add_argument("--player", type=int)
+    query_parser.add_argument("--table", type=int)
+    query_parser.add_argument("--hand", type=int)
+    query_parser.add_argument("--show", action="store_true", help="print the packets of the hands")
+    args = parser.parse_args(argv)
+
+    index = HandIndex(args.index)
+    try:
+        if args.command == "index":
+            for path in iterLogFiles(args.logs):
+                print "%s: %d hands" % (path, index.indexFile(path))
+        else:
+            for path, offset, hand_serial, game_id, serials in index.query(args.player, args.table, args.hand):
+                print "%s:%d hand=%d table=%d players=%s" % (path, offset, hand_serial, game_id, ",".join(map(str, serials)))
+                if args.show:
+                    for line in iterHandLines(path, offset, game_id):
+                        print "    " + line
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
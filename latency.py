@@ -0,0 +1,200 @@
+"""
+round trip latency of the actions of the bots
+
+Every action a protocol sends (Table.doCall, doRaise, doFold, doCheck) is
+timestamped and matched to the next action the server echoes for the same table
+and player, whatever its type: a call with nothing to call comes back as a
+check, a short stacked raise as a call. The latency is recorded under the
+action that was sent. The latencies go into logarithmic histograms per action, histograms of
+several processes can be merged (see supervisor.py).
+"""
+import math, time
+from twisted.internet import reactor, task
+from pokerpackets import networkpackets
+
+ACTIONS = {
+    networkpackets.PACKET_POKER_CALL: "call",
+    networkpackets.PACKET_POKER_RAISE: "raise",
+    networkpackets.PACKET_POKER_FOLD: "fold",
+    networkpackets.PACKET_POKER_CHECK: "check",
+}
+
+
+class Histogram(object):
+    """latencies (seconds) in buckets that are 5% wide, histograms can be merged"""
+
+    smallest = 0.0001
+    growth = 1.05
+
+    def __init__(self):
+        # bucket index: count
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _bucket(self, value):
+        if value <= self.smallest:
+            return 0
+        return int(math.ceil(math.log(value / self.smallest, self.growth)))
+
+    def record(self, value):
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """returns the latency percent of the samples are below (the upper bound of the bucket)"""
+        if not self.count:
+            return 0.0
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.smallest * self.growth ** bucket, self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def merge(self, other):
+        for bucket, count in other.counts.iteritems():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def toDict(self):
+        return {"counts": dict((str(bucket), count) for bucket, count in self.counts.iteritems()),
+                "count": self.count, "total": self.total, "max": self.max}
+
+    @classmethod
+    def fromDict(cls, data):
+        histogram = cls()
+        histogram.counts = dict((int(bucket), count) for bucket, count in data["counts"].iteritems())
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.max = data["max"]
+        return histogram
+
+
+class LatencyTracker(object):
+    """matches the actions sent to their echoes, use one tracker for all protocols of a process"""
+
+    # seconds after which an action without echo is counted as lost
+    timeout = 60.0
+
+    def __init__(self):
+        # action: Histogram
+        self.histograms = {}
+        # (game_id, serial): [(time the action was sent, packet type)]
+        self._pending = {}
+        self.sent = 0
+        self.lost = 0
+
+    def packetSent(self, packet):
+        if packet.type not in ACTIONS:
+            return
+        self.sent += 1
+        self._pending.setdefault((packet.game_id, packet.serial), []).append((time.time(), packet.type))
+
+    def packetReceived(self, packet):
+        if packet.type not in ACTIONS:
+            return
+        key = (packet.game_id, packet.serial)
+        pending = self._pending.get(key)
+        if not pending:
+            # an action of another player
+            return
+        sent, action = pending.pop(0)
+        latency = time.time() - sent
+        if not pending:
+            del self._pending[key]
+        histogram = self.histograms.get(ACTIONS[action])
+        if histogram is None:
+            histogram = self.histograms[ACTIONS[action]] = Histogram()
+        histogram.record(latency)
+
+    def expire(self):
+        """count the actions that got no echo in time as lost"""
+        limit = time.time() - self.timeout
+        for key, pending in self._pending.items():
+            while pending and pending[0][0] < limit:
+                pending.pop(0)
+                self.lost += 1
+            if not pending:
+                del self._pending[key]
+
+    def matched(self):
+        return sum(histogram.count for histogram in self.histograms.itervalues())
+
+    def merge(self, other):
+        for action, histogram in other.histograms.iteritems():
+            self.histograms.setdefault(action, Histogram()).merge(histogram)
+        self.sent += other.sent
+        self.lost += other.lost
+
+    def toDict(self):
+        return {"histograms": dict((action, histogram.toDict()) for action, histogram in self.histograms.iteritems()),
+                "sent": self.sent, "lost": self.lost}
+
+    @classmethod
+    def fromDict(cls, data):
+        tracker = cls()
+        tracker.histograms = dict((action, Histogram.fromDict(histogram)) for action, histogram in data["histograms"].iteritems())
+        tracker.sent = data["sent"]
+        tracker.lost = data["lost"]
+        return tracker
+
+    def report(self, elapsed=None):
+        """returns the lines of the report, elapsed is the time span of the samples (for the throughput)"""
+        lines = ["%-6s %8s %9s %9s %9s %9s %9s %9s" % ("action", "count", "mean ms", "p50 ms", "p95 ms", "p99 ms", "max ms", "per s")]
+        for action in sorted(self.histograms):
+            histogram = self.histograms[action]
+            lines.append("%-6s %8d %9.1f %9.1f %9.1f %9.1f %9.1f %9s" % (
+                action, histogram.count, histogram.mean() * 1000,
+                histogram.percentile(50) * 1000, histogram.percentile(95) * 1000, histogram.percentile(99) * 1000,
+                histogram.max * 1000, "%.1f" % (histogram.count / elapsed) if elapsed else "-"))
+        lines.append("%d actions sent, %d echoed, %d lost" % (self.sent, self.matched(), self.lost))
+        return lines
+
+
+def writeReport(filename, tracker, elapsed):
+    """write the final report of the tracker"""
+    with open(filename, "w") as fd:
+        fd.write("latency report %s, %.0fs\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), elapsed))
+        for line in tracker.report(elapsed):
+            fd.write(line + "\n")
+
+
+class LatencyReporter(object):
+    """prints the report of the tracker every interval seconds and writes the final report at shutdown"""
+
+    def __init__(self, tracker, interval=30.0, filename=None):
+        self.tracker = tracker
+        self.filename = filename
+        self.started = time.time()
+        self._last = (self.started, 0)
+        self._call = task.LoopingCall(self.printReport)
+        self._call.start(interval, now=False)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.finish)
+
+    def printReport(self):
+        self.tracker.expire()
+        now = time.time()
+        last_time, last_matched = self._last
+        matched = self.tracker.matched()
+        self._last = (now, matched)
+        for line in self.tracker.report(now - self.started):
+            print line
+        print "%.1f actions/s in the last %.0fs" % ((matched - last_matched) / max(now - last_time, 1e-9), now - last_time)
+
+    def finish(self):
+        if self._call.running:
+            self._call.stop()
+        self.tracker.expire()
+        if self.filename:
+            writeReport(self.filename, self.tracker, time.time() - self.started)
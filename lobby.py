@@ -0,0 +1,191 @@
+"""
+the tables of the lobby, indexed for queries
+
+Every PacketPokerTableList replaces the tables of the Lobby, only the tables
+that were added, changed or removed are touched. The betting structure of a
+table is parsed once. Sorted indexes on the stakes (big blind), the free seats,
+the average pot and the hands per hour find the first table of a range in
+O(log n):
+
+    lobby.first("free", low=1)                      # the fullest table with a free seat
+    lobby.query("stakes", high=200, reverse=True)   # the highest stakes up to a big blind of 2
+
+The tables command of the client selects with a filter and sorts by an index:
+
+    tables [free>0,stakes<=200,name~Fake] [-hands_per_hour]
+"""
+import re, operator
+from bisect import bisect_left, bisect_right, insort
+
+from explain import parseBettingStructure
+
+# the indexes of the lobby, attributes of LobbyTable
+INDEXES = ("stakes", "free", "average_pot", "hands_per_hour")
+
+# operators of a filter condition, the longer ones first
+OPERATORS = [
+    ("<=", operator.le),
+    (">=", operator.ge),
+    ("!=", operator.ne),
+    ("<", operator.lt),
+    (">", operator.gt),
+    ("=", operator.eq),
+    # the pattern is compiled by parseFilter
+    ("~", lambda value, pattern: pattern.search(value) is not None),
+]
+# attributes of LobbyTable a filter can test
+_ATTRIBUTES = dict.fromkeys(INDEXES + ("id", "seats", "players", "observers", "waiting",
+    "small_blind", "big_blind", "min_buy_in", "max_buy_in"), int)
+_ATTRIBUTES.update(dict.fromkeys(("name", "variant", "limit", "betting_structure"), str))
+_condition = re.compile(r"^(\w+)(%s)(.*)$" % "|".join(re.escape(symbol) for symbol, _ in OPERATORS))
+
+
+class LobbyTable(object):
+    """a table of the table list"""
+
+    def __init__(self, info):
+        self.id = info.id
+        self.update(info)
+
+    def update(self, info):
+        self.name = info.name
+        self.variant = info.variant
+        self.seats = info.seats
+        self.players = info.players
+        self.observers = info.observers
+        self.waiting = info.waiting
+        self.average_pot = info.average_pot
+        self.hands_per_hour = info.hands_per_hour
+        self.betting_structure = info.betting_structure
+        self.small_blind, self.big_blind, self.min_buy_in, self.max_buy_in, self.limit = \
+            parseBettingStructure(info.betting_structure)
+        self.stakes = self.big_blind
+        self.free = self.seats - self.players
+
+    def values(self):
+        """returns what the lobby shows of the table, a table changed if its values changed"""
+        return (self.name, self.variant, self.seats, self.players, self.observers, self.waiting,
+                self.average_pot, self.hands_per_hour, self.betting_structure)
+
+    def __str__(self):
+        return "id=%s\t%-20s\t%s\t%d/%d\tpot %d\t%d/h" % (self.id, self.name, self.betting_structure,
+            self.players, self.seats, self.average_pot, self.hands_per_hour)
+
+
+def parseFilter(text):
+    """returns the conditions [(attribute, symbol, function, value)] of a filter like "free>0,name~Fake",
+    raises ValueError if the filter is broken"""
+    conditions = []
+    for part in text.split(","):
+        if not part:
+            continue
+        match = _condition.match(part)
+        if match is None:
+            raise ValueError("%r is no condition like free>0" % part)
+        attribute, symbol, value = match.groups()
+        if attribute not in _ATTRIBUTES:
+            raise ValueError("unknown attribute %r, one of %s" % (attribute, ", ".join(sorted(_ATTRIBUTES))))
+        if symbol == "~":
+            if _ATTRIBUTES[attribute] is int:
+                raise ValueError("%r is a number, ~ matches text only" % attribute)
+            try:
+                value = re.compile(value)
+            except re.error, e:
+                raise ValueError("%r is no regular expression: %s" % (value, e))
+        elif _ATTRIBUTES[attribute] is int:
+            value = int(value)
+        conditions.append((attribute, symbol, dict(OPERATORS)[symbol], value))
+    return conditions
+
+
+class Lobby(object):
+    """the tables of the table list with sorted indexes"""
+
+    def __init__(self):
+        # id: LobbyTable
+        self.tables = {}
+        # index: sorted [(value, id)]
+        self._indexes = dict((index, []) for index in INDEXES)
+
+    def __len__(self):
+        return len(self.tables)
+
+    def _add(self, table):
+        for index, entries in self._indexes.iteritems():
+            insort(entries, (getattr(table, index), table.id))
+
+    def _remove(self, table):
+        for index, entries in self._indexes.iteritems():
+            del entries[bisect_left(entries, (getattr(table, index), table.id))]
+
+    def update(self, infos):
+        """replace the tables by the PacketPokerTable of a table list,
+        returns the ids of the tables that were (added, changed, removed)"""
+        added, changed, seen = [], [], set()
+        for info in infos:
+            seen.add(info.id)
+            table = self.tables.get(info.id)
+            if table is None:
+                table = self.tables[info.id] = LobbyTable(info)
+                self._add(table)
+                added.append(table.id)
+                continue
+            before = table.values()
+            indexed = dict((index, getattr(table, index)) for index in INDEXES)
+            table.update(info)
+            if table.values() == before:
+                continue
+            changed.append(table.id)
+            for index, entries in self._indexes.iteritems():
+                value = getattr(table, index)
+                if value != indexed[index]:
+                    del entries[bisect_left(entries, (indexed[index], table.id))]
+                    insort(entries, (value, table.id))
+        removed = [table_id for table_id in self.tables if table_id not in seen]
+        for table_id in removed:
+            self._remove(self.tables.pop(table_id))
+        return added, changed, removed
+
+    def query(self, index, low=None, high=None, reverse=False, where=None):
+        """yields the tables with low <= value <= high of the index in the order of the index,
+        the first one is found in O(log n). where(table) can skip tables"""
+        entries = self._indexes[index]
+        start = 0 if low is None else bisect_left(entries, (low,))
+        end = len(entries) if high is None else bisect_right(entries, (high, float("inf")))
+        positions = xrange(end - 1, start - 1, -1) if reverse else xrange(start, end)
+        for position in positions:
+            table = self.tables[entries[position][1]]
+            if where is None or where(table):
+                yield table
+
+    def first(self, index, low=None, high=None, reverse=False, where=None):
+        """returns the first table of query() or None"""
+        for table in self.query(index, low, high, reverse, where):
+            return table
+        return None
+
+    def select(self, conditions, sort=None):
+        """returns the tables that meet the conditions of parseFilter(), sorted by an index
+        ("-index" sorts descending). The range of the sort index is narrowed by the conditions on it"""
+        reverse = sort is not None and sort.startswith("-")
+        index = sort.lstrip("-") if sort else None
+        if index is None:
+            # no sort given: narrow by the first condition on an index
+            indexed = [attribute for attribute, symbol, _, _ in conditions if attribute in INDEXES and symbol != "~"]
+            index = indexed[0] if indexed else "stakes"
+        if index not in INDEXES:
+            raise ValueError("can not sort by %r, one of %s" % (index, ", ".join(INDEXES)))
+        low = high = None
+        for attribute, symbol, _, value in conditions:
+            if attribute != index:
+                continue
+            if symbol in ("=", ">=", ">"):
+                low = value if low is None else max(low, value)
+            if symbol in ("=", "<=", "<"):
+                high = value if high is None else min(high, value)
+        def where(table):
+            for attribute, _, function, value in conditions:
+                if not function(getattr(table, attribute), value):
+                    return False
+            return True
+        return list(self.query(index, low, high, reverse, where if conditions else None))
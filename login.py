@@ -0,0 +1,154 @@
+"""
+login at the site with pooled http connections and cached auth keys
+
+All logins of a process go through one LoginClient per site. It keeps the http
+connections to the site open (twisted.web.client.HTTPConnectionPool), lets only
+max_concurrent requests run at the same time, so a restart of many clients does
+not hammer the site, and remembers the auth_key of every login in a json file
+until it expires. A client that logs in again (e.g. after a reconnect) sends its
+PacketAuth right away without asking the site.
+"""
+import os, time
+from StringIO import StringIO
+import simplejson
+from twisted.internet import reactor, defer
+from twisted.python.failure import Failure
+from twisted.web.client import Agent, HTTPConnectionPool, FileBodyProducer, readBody
+from twisted.web.http_headers import Headers
+
+CACHE_FILE = os.path.expanduser("~/.pokercli-auth.json")
+
+_clients = {}
+
+
+class LoginError(Exception):
+    pass
+
+
+class AuthCache(object):
+    """auth keys per (site, email) with the time they expire, kept in a json file"""
+
+    def __init__(self, filename=CACHE_FILE):
+        self.filename = filename
+        # "site email": [auth_key, expires]
+        self._entries = {}
+        self.load()
+
+    def _key(self, site, email):
+        return "%s %s" % (site, email)
+
+    def load(self):
+        if not self.filename or not os.path.exists(self.filename):
+            return
+        now = time.time()
+        try:
+            with open(self.filename) as fd:
+                entries = simplejson.load(fd)
+            self._entries = dict((key, [auth_key, expires]) for key, (auth_key, expires) in entries.iteritems()
+                                 if isinstance(auth_key, basestring) and float(expires) > now)
+        except Exception:
+            # a broken cache costs one login per email, nothing more
+            self._entries = {}
+
+    def save(self):
+        """write the entries to a temporary file and move it over the cache, the keys are readable by the owner only"""
+        if not self.filename:
+            return
+        tmp = self.filename + ".tmp"
+        fd = os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600), "w")
+        with fd:
+            simplejson.dump(self._entries, fd)
+        os.rename(tmp, self.filename)
+
+    def get(self, site, email):
+        """returns the auth key or None if there is none or it expired"""
+        entry = self._entries.get(self._key(site, email))
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def put(self, site, email, auth_key, expires):
+        self._entries[self._key(site, email)] = [auth_key, expires]
+        self.save()
+
+    def remove(self, site, email):
+        if self._entries.pop(self._key(site, email), None) is not None:
+            self.save()
+
+
+class LoginClient(object):
+    """logs in at one site, use getLoginClient() to get the one of the process"""
+
+    # seconds an auth key is used if the site does not tell (expires_in)
+    ttl = 3600.0
+    # the auth key is not used anymore this many seconds before it expires
+    margin = 60.0
+
+    def __init__(self, msgpokerurl, cache=None, max_concurrent=4):
+        self.msgpokerurl = msgpokerurl.rstrip("/")
+        self.cache = cache if cache is not None else AuthCache()
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = max_concurrent
+        self.agent = Agent(reactor, pool=self.pool)
+        self.semaphore = defer.DeferredSemaphore(max_concurrent)
+        # email: deferreds waiting for the login that is running, parallel logins of the same email share it
+        self._running = {}
+
+    def login(self, email, password):
+        """returns a deferred that fires with the auth key of the email"""
+        auth_key = self.cache.get(self.msgpokerurl, email)
+        if auth_key is not None:
+            return defer.succeed(auth_key)
+        if email in self._running:
+            d = defer.Deferred()
+            self._running[email].append(d)
+            return d
+        self._running[email] = []
+        d = self.semaphore.run(self._request, email, password)
+        d.addCallback(self._loggedIn, email)
+        d.addBoth(self._done, email)
+        return d
+
+    def _request(self, email, password):
+        body = simplejson.dumps({'email': email, 'password': password, 'rememberMe': False})
+        d = self.agent.request('POST', self.msgpokerurl + "/site/login?api_key=special-key",
+            Headers({'Content-Type': ['application/json']}), FileBodyProducer(StringIO(body)))
+        def response(response):
+            d = readBody(response)
+            if response.code != 200:
+                d.addCallback(lambda body: defer.fail(LoginError("login of %s failed: %d %s" % (email, response.code, body))))
+            return d
+        d.addCallback(response)
+        return d
+
+    def _loggedIn(self, body, email):
+        resp = simplejson.loads(body)
+        auth_key = resp['auth_key']
+        ttl = float(resp.get('expires_in', self.ttl))
+        self.cache.put(self.msgpokerurl, email, auth_key, time.time() + ttl - self.margin)
+        return auth_key
+
+    def _done(self, result, email):
+        for d in self._running.pop(email, []):
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+        return result
+
+    def invalidate(self, email):
+        """forget the auth key of the email, e.g. the server refused it"""
+        self.cache.remove(self.msgpokerurl, email)
+
+    def close(self):
+        """returns a deferred that fires when the pooled connections are closed"""
+        return self.pool.closeCachedConnections()
+
+
+def getLoginClient(msgpokerurl, **kw):
+    """returns the login client of the site, it is created (with the keyword arguments) if it does not exist yet"""
+    key = msgpokerurl.rstrip("/")
+    if key not in _clients:
+        _clients[key] = client = LoginClient(msgpokerurl, **kw)
+        reactor.addSystemEventTrigger('before', 'shutdown', client.close)
+    return _clients[key]
@@ -0,0 +1,96 @@
+"""
+buffered log files shared by all screens of a process
+
+Every log file is opened once, lines are collected in memory and written in one
+go when the flush timer fires or the buffer is full. Files are rotated when they
+grow beyond max_size. All sinks are closed (and thereby flushed) before the
+reactor shuts down.
+"""
+import os
+from twisted.internet import reactor
+
+_sinks = {}
+_shutdown_trigger = []
+
+
+class LogSink(object):
+    """one append handle per file, writes are buffered and flushed on a timer or by size"""
+
+    def __init__(self, filename, truncate=False, flush_interval=1.0, buffer_size=64*1024,
+            max_size=50*1024*1024, backups=5):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.max_size = max_size
+        self.backups = backups
+        self._fd = open(filename, "w" if truncate else "a")
+        self._size = self._fd.tell() if not truncate else 0
+        self._buffer = []
+        self._buffered = 0
+        self._flush_call = None
+
+    def write(self, line):
+        """add a line (without line break) to the buffer"""
+        self._buffer.append(line)
+        self._buffered += len(line) + 1
+        if self._buffered >= self.buffer_size:
+            self.flush()
+        elif self._flush_call is None:
+            self._flush_call = reactor.callLater(self.flush_interval, self.flush)
+
+    def flush(self):
+        """write the buffered lines to the file, rotate it if it got too big"""
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        if not self._buffer or self._fd is None:
+            return
+        self._buffer.append("")
+        self._fd.write("\n".join(self._buffer))
+        self._fd.flush()
+        self._size += self._buffered
+        self._buffer = []
+        self._buffered = 0
+        if self.max_size and self._size >= self.max_size:
+            self.rotate()
+
+    def rotate(self):
+        """move the file to filename.1 (filename.1 to filename.2 and so on) and start a new one"""
+        self._fd.close()
+        for index in range(self.backups - 1, 0, -1):
+            src = "%s.%d" % (self.filename, index)
+            if os.path.exists(src):
+                os.rename(src, "%s.%d" % (self.filename, index + 1))
+        if self.backups > 0:
+            os.rename(self.filename, self.filename + ".1")
+        self._fd = open(self.filename, "w")
+        self._size = 0
+
+    def close(self):
+        """flush and close the file, the sink can not be used afterwards"""
+        self.flush()
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+        _sinks.pop(os.path.abspath(self.filename), None)
+
+
+def getSink(filename, **kw):
+    """returns the sink of the file, it is created (with the keyword arguments) if it does not exist yet"""
+    key = os.path.abspath(filename)
+    if key not in _sinks:
+        if not _shutdown_trigger:
+            _shutdown_trigger.append(reactor.addSystemEventTrigger('before', 'shutdown', closeAll))
+        _sinks[key] = LogSink(filename, **kw)
+    return _sinks[key]
+
+def flushAll():
+    """flush all open sinks"""
+    for sink in _sinks.values():
+        sink.flush()
+
+def closeAll():
+    """flush and close all open sinks"""
+    for sink in _sinks.values():
+        sink.close()
@@ -1,98 +1,253 @@
 from twisted.internet import reactor
-from pokerprotocol import PokerFactory, PokerClientProtocol, STATE_JOIN
+from pokerprotocol import PokerFactory, PokerClientProtocol
 from pokerpackets.networkpackets import PACKET_POKER_STATE
-from explain import GAME_STATE_END
+from explain import GAME_STATE_END, GAME_STATE_PRE_FLOP
+from preflop import getPreflopTable
+from logsink import getSink
 try:
     from localsecret import getPasswordForBot
 except ImportError:
     print "ERROR: localsecret.py does not provide getPasswordForBot (or does not exist)"
     exit(0)
 
+import os, re, sys
 import random
-import time
+
+# counters of the bots of this process, reported to the supervisor (see supervisor.py)
+counters = {"hands": 0, "actions": 0, "errors": 0, "connected": 0}
 
 class DbgScreen(object):
     
-    def __init__(self, id):
-        self.dbfn = '/home/olaf/Desktop/bots%s.log' % id
-        with open(self.dbfn, "w") as fh:
-            fh.write("hello again\n\n")
+    def __init__(self, id, log_dir=".", verbose=True):
+        self.dbfn = os.path.join(log_dir, 'bots%s.log' % id)
+        self._log = getSink(self.dbfn, truncate=True)
+        self._log.write("hello again\n")
         self.id = id
+        self.verbose = verbose
     def addLine(self, astr):
-        print self.id, astr
+        if astr.startswith(" EEE "):
+            counters["errors"] += 1
+        if self.verbose:
+            print self.id, astr
         # if not astr.startswith(" EEE "):
         #     return
         # astr = astr[5:]
-        with open(self.dbfn, "a") as fh:
-            fh.write("%s\n"%(astr,))
+        self._log.write(astr)
+    def flush(self):
+        self._log.flush()
     def _log_into_file(*args, **kw):
         pass
 
 class PokerBotFactory(PokerFactory):
-    def __init__(self, screen, msgpokerurl, bot_serial):
-        PokerFactory.__init__(self, screen, msgpokerurl)
+    # seconds to wait before the login, the bots do not log in all at once
+    login_jitter = (0.1, 5.0)
+
+    def __init__(self, screen, msgpokerurl, bot_serial, table_filter=None, latency=None, tables_per_bot=1):
+        PokerFactory.__init__(self, screen, msgpokerurl, latency=latency)
         self.protocol = PokerBotProtocol
         self.bot_serial = bot_serial
+        # regular expression the names of the tables to join have to match
+        self.table_filter = re.compile(table_filter) if table_filter else None
+        # number of tables every bot plays at the same time
+        self.tables_per_bot = tables_per_bot
 
     def letsGo(self, protocol):
-        #wait between 0.1 and 5 seconds
-        time.sleep(random.randint(1,50)/10.)
-        #login
-        self.protocol_instance.botLogin(name="BOT%s"%self.bot_serial, password=getPasswordForBot(self.bot_serial))
+        # the reactor must not sleep, it serves the other bots in the meantime
+        reactor.callLater(random.uniform(*self.login_jitter), self.login, protocol)
+
+    def login(self, protocol):
+        if not protocol.connected:
+            return
+        protocol.botLogin(name="BOT%s"%self.bot_serial, password=getPasswordForBot(self.bot_serial))
 
 class PokerBotProtocol(PokerClientProtocol):
-    def addTable(self, p):
-        #check if table is suitable for this bot/ e.g. if it is not full
-        # and try to join
-        def table_is_ok(p):
-            return p.seats - p.players > 0
-
-        if not hasattr(self, "logged_in"):
-            self.logged_in = False
-
-        if table_is_ok(p) and not self.logged_in:
-            self.logged_in = True
-            self.executeCmd("join %s" % p.id)
-        
-    def changeState(self, new_state):
-        PokerClientProtocol.changeState(self, new_state)
-        if new_state == STATE_JOIN:
-            self.executeCmd("seat")
-            self.executeCmd("buy_in")
-    
+    # seconds the bot thinks before it acts
+    action_delay = (1.0, 2.0)
+
+    def __init__(self, *args, **kw):
+        PokerClientProtocol.__init__(self, *args, **kw)
+        # game_id of the tables the bot asked to join
+        self._joined = set()
+        # game_id: the action that is scheduled at the table
+        self._action_calls = {}
+
+    def lobbyUpdated(self, added, changed, removed):
+        PokerClientProtocol.lobbyUpdated(self, added, changed, removed)
+        table_filter = self.factory.table_filter
+        def table_is_ok(table):
+            if table.id in self._joined:
+                return False
+            return table_filter is None or table_filter.search(table.name) is not None
+
+        while len(self._joined) < self.factory.tables_per_bot:
+            # the fullest table with a free seat, the bots fill up the tables one after the other
+            table = self.lobby.first("free", low=1, where=table_is_ok)
+            if table is None:
+                break
+            self._joined.add(table.id)
+            self.executeCmd("join %s" % table.id)
+
+    def refreshLobby(self):
+        # the table list is only needed to find more tables
+        if len(self._joined) < self.factory.tables_per_bot:
+            PokerClientProtocol.refreshLobby(self)
+
+    def createTable(self, table_info):
+        table = PokerClientProtocol.createTable(self, table_info)
+        if table.seat == -1:
+            self.executeCmd("seat @%d" % table.id)
+            self.executeCmd("buy_in @%d" % table.id)
+        else:
+            # joined again after a reconnect, the bot kept its seat and chips
+            self.executeCmd("si @%d" % table.id)
+        return table
+
+    def resume(self, info):
+        PokerClientProtocol.resume(self, info)
+        self._joined.update(info['game_ids'])
+
+    def removeTable(self, game_id):
+        # the table stays in _joined, a bot that left broke does not join it again
+        self.cancelAction(game_id)
+        PokerClientProtocol.removeTable(self, game_id)
+
     def defaultHandler(self, packet):
         if packet.type == PACKET_POKER_STATE and packet.string == GAME_STATE_END:
-            self.checkIfRebuy()
+            counters["hands"] += 1
+            table = self.tables.get(packet.game_id)
+            if table is not None:
+                self.checkIfRebuy(table)
         PokerClientProtocol.defaultHandler(self, packet)
 
-    def checkIfRebuy(self):
-        money = self.avatar.getMoney()
-        chips = self.avatar.getChips()
+    def checkIfRebuy(self, table):
+        money = table.avatar.getMoney()
+        chips = table.avatar.getChips()
         if chips < 10:
             if money > 0:
-                self.executeCmd("bi")
+                self.executeCmd("bi @%d" % table.id)
             else:
-                self.executeCmd("leave")
+                self.executeCmd("leave @%d" % table.id)
                 # Todo loose connection
 
-    def itsYourTurn(self, last_chance=False):
-        PokerClientProtocol.itsYourTurn(self)
-        time.sleep(random.randint(1,2))
+    def handlePacketPokerPosition(self, packet):
+        # the turn is over (e.g. the server timed the bot out), a delayed action would be too late
+        self.cancelAction(packet.game_id)
+        PokerClientProtocol.handlePacketPokerPosition(self, packet)
+
+    def connectionMade(self):
+        counters["connected"] += 1
+        PokerClientProtocol.connectionMade(self)
+
+    def connectionLost(self, reason):
+        counters["connected"] -= 1
+        for game_id in self._action_calls.keys():
+            self.cancelAction(game_id)
+        PokerClientProtocol.connectionLost(self, reason)
+
+    def cancelAction(self, game_id):
+        """forget the action that is scheduled at the table, if any"""
+        action_call = self._action_calls.pop(game_id, None)
+        if action_call is not None and action_call.active():
+            action_call.cancel()
+
+    def itsYourTurn(self, table=None, last_chance=False):
+        if table is None:
+            table = self.table
+        PokerClientProtocol.itsYourTurn(self, table)
+        self.cancelAction(table.id)
+        self._action_calls[table.id] = reactor.callLater(random.uniform(*self.action_delay), self.act, table, last_chance)
+
+    def act(self, table, last_chance=False):
+        """choose and send the action of the turn at the table"""
+        self._action_calls.pop(table.id, None)
+        if self.tables.get(table.id) is not table:
+            # the bot left the table in the meantime
+            return
+        counters["actions"] += 1
         if last_chance:
-            self.executeCmd("call")
+            self.executeCmd("call @%d" % table.id)
             return
+        if table._game_state == GAME_STATE_PRE_FLOP:
+            equity = table.preflopEquity()
+            if equity is not None:
+                self.preflopAction(table, equity)
+                return
         rand = random.random()
 
         if rand < 0.3:
-            self.executeCmd("raise 1000")
+            self.executeCmd("raise 1000 @%d" % table.id)
         elif rand < 0.4:
-            self.executeCmd("fold")
+            self.executeCmd("fold @%d" % table.id)
         else:
-            self.executeCmd("call")
+            self.executeCmd("call @%d" % table.id)
+
+    def preflopAction(self, table, equity):
+        """act according to the precomputed equity compared to the equity of an average hand"""
+        average = 1.0 / (table.opponents() + 1)
+        if equity > 1.5 * average:
+            self.executeCmd("raise 1000 @%d" % table.id)
+        elif equity < 0.7 * average and random.random() < 0.8:
+            self.executeCmd("fold @%d" % table.id)
+        else:
+            self.executeCmd("call @%d" % table.id)
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="run poker bots in one process")
+    parser.add_argument("--bots", type=int, default=8, help="number of bots")
+    parser.add_argument("--first-serial", type=int, default=100, help="serial of the first bot (BOT<serial>)")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=19380)
+    parser.add_argument("--msgpokerurl", default="http://poker.pokermania.de/")
+    parser.add_argument("--tables", help="regular expression the names of the tables to join have to match")
+    parser.add_argument("--tables-per-bot", type=int, default=1, help="number of tables every bot plays at the same time")
+    parser.add_argument("--log-dir", default=".", help="directory of the bot logs")
+    parser.add_argument("--quiet", action="store_true", help="do not print the log lines")
+    parser.add_argument("--workers", type=int, default=0, help="split the bots across this many worker processes")
+    parser.add_argument("--summary-interval", type=float, default=30.0, help="seconds between two summaries of the workers")
+    parser.add_argument("--latency", action="store_true", help="load test: measure the round trip times of the actions")
+    parser.add_argument("--latency-interval", type=float, default=30.0, help="seconds between two latency reports")
+    parser.add_argument("--latency-report", help="file the final latency report is written to")
+    parser.add_argument("--status-interval", type=float, default=5.0, help=argparse.SUPPRESS)
+    parser.add_argument("--status-fd", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.workers:
+        from supervisor import Supervisor
+        worker_args = ["--host", args.host, "--port", str(args.port), "--msgpokerurl", args.msgpokerurl, "--log-dir", args.log_dir,
+                       "--tables-per-bot", str(args.tables_per_bot)]
+        if args.tables:
+            worker_args += ["--tables", args.tables]
+        if args.quiet:
+            worker_args.append("--quiet")
+        if args.latency:
+            worker_args.append("--latency")
+        Supervisor(worker_args, args.first_serial, args.bots, args.workers,
+            status_interval=args.status_interval, summary_interval=args.summary_interval,
+            latency=args.latency, latency_report=args.latency_report).start()
+        reactor.run()
+        return 0
+
+    latency = None
+    if args.latency:
+        from latency import LatencyTracker, LatencyReporter
+        latency = LatencyTracker()
+        if args.status_fd is None:
+            # a worker leaves the reports to the supervisor
+            LatencyReporter(latency, args.latency_interval, args.latency_report)
+    # map the preflop table once, before the bots start
+    getPreflopTable()
+    for i in range(args.first_serial, args.first_serial + args.bots):
+        factory = PokerBotFactory(DbgScreen(i, args.log_dir, verbose=not args.quiet), msgpokerurl=args.msgpokerurl,
+            bot_serial=i, table_filter=args.tables, latency=latency, tables_per_bot=args.tables_per_bot)
+        reactor.connectTCP(args.host, args.port, factory)
+    if args.status_fd is not None:
+        from supervisor import StatusReporter
+        StatusReporter(args.status_fd, counters, args.status_interval, latency)
+    reactor.run()
+    return 0
 
 
-# screen = 
-for i in range(100,108):
-    print i
-    reactor.connectTCP("localhost",19380, PokerBotFactory(DbgScreen(i), msgpokerurl="http://poker.pokermania.de/", bot_serial=i))
-reactor.run()
\ No newline at end of file
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -71,14 +71,19 @@ Remember to call nodelay(1) in curses, to make getch() non-blocking.
 """
 
 # System Imports
+import os
+import time
+import tempfile
 import curses
 import curses.wrapper
 
 # Twisted imports
-from twisted.internet import reactor
+from twisted.internet import reactor, task
 # from twisted.python import log
 
 from pokerprotocol import PokerFactory
+from scrollback import Scrollback
+from logsink import getSink
 
 class TextTooLongError(Exception):
     pass
@@ -99,14 +104,20 @@ class CursesStdIO:
 
 
 class Screen(CursesStdIO):
-    def __init__(self, stdscr, protocol=None):
+    # repaints per second at most, lines arriving in between are painted together
+    fps = 20
+    # lines kept in memory, older lines are spilled to the scrollback file
+    scrollback_lines = 5000
+    # matches of /search that are shown
+    max_search_results = 50
+
+    def __init__(self, stdscr, protocol=None, scrollbackfn=None):
         self.timer = 0
         self.statusText = "TEST CURSES APP -"
         self.searchText = ''
         self.stdscr = stdscr
         self._logfn = ""
-        if self._logfn:
-            open(self._logfn, "w").close()
+        self._log = getSink(self._logfn, truncate=True) if self._logfn else None
 
         # set screen attributes
         self.stdscr.nodelay(1) # this is used to make input calls non-blocking
@@ -115,7 +126,26 @@ class Screen(CursesStdIO):
         curses.curs_set(2)
 
         self.rows, self.cols = self.stdscr.getmaxyx()
-        self.lines = []
+        self._remove_scrollbackfn = scrollbackfn is None
+        if scrollbackfn is None:
+            fd, scrollbackfn = tempfile.mkstemp(prefix="pokercli-", suffix=".scrollback")
+            os.close(fd)
+        self.lines = Scrollback(scrollbackfn, maxlen=self.scrollback_lines)
+        # number of lines the log pane is scrolled back
+        self._scroll = 0
+
+        # the log pane scrolls, so a new line only costs drawing that line
+        self.logwin = curses.newwin(self.rows - 3, self.cols, 1, 0)
+        self.logwin.scrollok(1)
+        self.logwin.idlok(1)
+        # the debug panel is drawn on top of the log pane
+        self.debugwin = curses.newwin(self.rows - 2, min(70, self.cols - 1), 0, max(self.cols-70, 1))
+
+        self._new_lines = 0
+        self._full_redraw = True
+        self._frame_call = None
+        self._last_frame = 0
+        self._debug_lines = None
 
         curses.start_color()
 
@@ -131,52 +161,127 @@ class Screen(CursesStdIO):
         self.close()
 
     def _log_into_file(self, text):
-        if self._logfn:
-            with open(self._logfn, "a") as fd:
-                fd.write(text+'\n')
-        
+        if self._log is not None:
+            self._log.write(text)
+
+    def flush(self):
+        """ write the buffered log lines to the log file"""
+        if self._log is not None:
+            self._log.flush()
+
     def addLine(self, text):
         """ add a line to the internal list of lines"""
         self._log_into_file(text)
         self.lines.append(text)
+        if self._scroll:
+            # keep showing the same lines while scrolled back
+            self._scroll += 1
+            if self._scroll > self._maxScroll():
+                self._scroll = self._maxScroll()
+                self._full_redraw = True
+        else:
+            self._new_lines += 1
+        self._scheduleFrame()
+
+    def _maxScroll(self):
+        return max(0, len(self.lines) - (self.rows - 3))
+
+    def scroll(self, lines):
+        """ scroll the log pane back (lines > 0) or forward (lines < 0)"""
+        self._scroll = min(max(0, self._scroll + lines), self._maxScroll())
         self.redisplayLines()
-        self._pos_cursor()
 
-    def redisplayLines(self):
-        return self._redisplayLines()
-        self.paintDebug()
-    def _redisplayLines(self):
-        """ method for redisplaying lines 
-            based on internal list of lines """
+    def search(self, text):
+        """ show the lines of the whole history that contain text"""
+        self.addLine(" [/] searching %r" % text)
+        def scan():
+            found = 0
+            for lineno, line in self.lines.iterLines():
+                if text in line:
+                    found += 1
+                    if found <= self.max_search_results:
+                        self.addLine(" [/] %d: %s" % (lineno, line))
+                # give the reactor a chance to handle packets, the history might be huge
+                yield None
+            self.addLine(" [/] %d lines found for %r" % (found, text))
+        task.cooperate(scan())
+
+    def doScreenCmd(self, cmd):
+        """ commands starting with a slash are handled by the screen itself"""
+        args = cmd.split(None, 1)
+        if args and args[0] == "search" and len(args) > 1:
+            self.search(args[1])
+        else:
+            self.addLine(" [/] unknown command %r, try /search <text>" % cmd)
 
-        self.stdscr.clear()
-        self.paintStatus(self.statusText)
-        i = 0
-        index = len(self.lines) - 1
-        while i < (self.rows - 3) and index >= 0:
-            self.stdscr.addstr(self.rows - 3 - i, 0, self.lines[index][:self.cols], 
-                               curses.color_pair(2))
-            i += 1
-            index -= 1
+    def redisplayLines(self):
+        """ repaint all visible lines with the next frame"""
+        self._full_redraw = True
+        self._scheduleFrame()
+
+    def _scheduleFrame(self):
+        """ paint a frame as soon as the frame rate allows it, unless one is pending already"""
+        if self._frame_call is None:
+            delay = max(0, self._last_frame + 1.0 / self.fps - time.time())
+            self._frame_call = reactor.callLater(delay, self._paintFrame)
+
+    def _paintFrame(self):
+        """ paint the lines added since the last frame, the debug panel and the status bar"""
+        self._frame_call = None
+        self._last_frame = time.time()
+        height = self.rows - 3
+        if self._full_redraw or self._new_lines >= height:
+            self.logwin.erase()
+            new_lines = self.lines.visible(height, self._scroll)
+            status = self.statusText
+            if self._scroll:
+                status += " [scrolled back %d lines]" % self._scroll
+            self.paintStatus(status)
+        elif self._new_lines:
+            self.logwin.scroll(self._new_lines)
+            new_lines = self.lines.visible(self._new_lines)
+        else:
+            new_lines = []
+        for y, line in enumerate(new_lines, height - len(new_lines)):
+            # the last column is left out, writing it would scroll the pane
+            self.logwin.addnstr(y, 0, line, self.cols - 1, curses.color_pair(2))
+        self._new_lines = 0
+        self._full_redraw = False
+        self.logwin.noutrefresh()
         self.paintDebug()
-        self.stdscr.refresh()
         self._pos_cursor()
+        self.stdscr.noutrefresh()
+        curses.doupdate()
 
     def paintDebug(self):
+        """ paint the debug panel into the virtual screen, it is shown with the next doupdate"""
         # import rpdb2; rpdb2.start_embedded_debugger("haha")
         if not self._p:
             return
         lines = self._p.getDebugLines()
+        if lines is self._debug_lines:
+            # nothing changed, the panel only has to be put on top of the log pane again
+            self.debugwin.touchwin()
+            self.debugwin.noutrefresh()
+            return
+        self._debug_lines = lines
+        width = self.debugwin.getmaxyx()[1]
+        self.debugwin.erase()
+        self.debugwin.addnstr(0, 0, "%-70s" % "Debug:", width, curses.color_pair(3))
         i = 0
         index = len(lines) - 1
-        self.stdscr.addstr(0, max(self.cols-70, 1), "%-70s" % "Debug:", 
-                               curses.color_pair(3))
         while i < (self.rows - 3) and index >= 0:
-            self.stdscr.addstr(i+1, max(self.cols-70, 1), "%-70s" % lines[index][:70], 
-                               curses.color_pair(3))
+            try:
+                self.debugwin.addnstr(i+1, 0, "%-70s" % lines[index][:70], width,
+                                      curses.color_pair(3))
+            except curses.error:
+                # writing the bottom right corner moves the cursor out of the window
+                pass
             i += 1
             index -= 1
-        self.stdscr.refresh()
+        # the log pane may have been painted over the panel
+        self.debugwin.touchwin()
+        self.debugwin.noutrefresh()
 
     def paintStatus(self, text):
         if len(text) > self.cols: raise TextTooLongError
@@ -198,15 +303,28 @@ class Screen(CursesStdIO):
             self.searchText = self.searchText[:-1]
         elif c == ord('\t'):
             #TODO tab completion
-            self.paintDebug()
+            self.redisplayLines()
             return
         elif c in (curses.KEY_MOUSE, curses.KEY_SF, curses.KEY_SR):
             return
-        elif c in (curses.KEY_UP, curses.KEY_DOWN):
+        elif c == curses.KEY_UP:
+            self.scroll(1)
+            return
+        elif c == curses.KEY_DOWN:
+            self.scroll(-1)
+            return
+        elif c == curses.KEY_PPAGE:
+            self.scroll(self.rows - 4)
+            return
+        elif c == curses.KEY_NPAGE:
+            self.scroll(-(self.rows - 4))
             return
         elif c == curses.KEY_ENTER or c == 10:
             if len(self.searchText) == 0: return
-            self.executeCmd(self.searchText)
+            if self.searchText.startswith("/"):
+                self.doScreenCmd(self.searchText[1:])
+            else:
+                self.executeCmd(self.searchText)
             self.stdscr.refresh()
             self.searchText = ''
         elif 0 <= c <= 255:
@@ -232,6 +350,13 @@ class Screen(CursesStdIO):
 
     def close(self):
         """ clean up """
+        if self._frame_call is not None and self._frame_call.active():
+            self._frame_call.cancel()
+        self._frame_call = None
+        self.flush()
+        self.lines.close()
+        if self._remove_scrollbackfn and os.path.exists(self.lines.spillfn):
+            os.remove(self.lines.spillfn)
 
         curses.nocbreak()
         self.stdscr.keypad(0)
@@ -239,14 +364,28 @@ class Screen(CursesStdIO):
         curses.endwin()
 
 if __name__ == '__main__':
-    import locale
+    import locale, argparse
+    from login import getLoginClient, AuthCache, CACHE_FILE
+    parser = argparse.ArgumentParser(description="curses poker client")
+    parser.add_argument("--binlog", help="log the packets in the binary format to this file as well")
+    parser.add_argument("--compress", choices=("zlib", "lzma"), help="compression of the binary log")
+    parser.add_argument("--msgpokerurl", default="http://poker.pokermania.de/", help="site the logins go to")
+    parser.add_argument("--auth-cache", default=CACHE_FILE, help="file the auth keys of the logins are cached in")
+    args = parser.parse_args()
+    getLoginClient(args.msgpokerurl, cache=AuthCache(args.auth_cache))
+    binlog = None
+    if args.binlog:
+        from binlog import BinaryLogWriter
+        binlog = BinaryLogWriter(args.binlog, args.compress)
     locale.setlocale(locale.LC_ALL,"")
+    from preflop import getPreflopTable
+    getPreflopTable() # map the preflop equities before the first table
     stdscr = curses.initscr() # initialize curses
     screen = Screen(stdscr)   # create Screen object
     stdscr.refresh()
     def logItG(self, astr, prefix=" [D] "):
         screen.addLine(prefix + str(astr))
-    pokerFactory = PokerFactory(screen, msgpokerurl="http://poker.pokermania.de/")
+    pokerFactory = PokerFactory(screen, msgpokerurl=args.msgpokerurl, binlog=binlog)
     reactor.addReader(screen) # add screen object as a reader to the reactor
     reactor.connectTCP("poker.pokermania.de",19380,pokerFactory) # connect to pokernetwork
     reactor.run() # have fun!
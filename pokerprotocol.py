@@ -1,29 +1,77 @@
-import traceback, sys
+import traceback, sys, time, random
 import urllib
-import simplejson
+from twisted.internet import reactor, defer, task
 from pokerpackets import packets, networkpackets
 from pokernetwork.client import UGAMEClientProtocol, UGAMEClientFactory
 
 from explain import Player, Table, NoneTable
-from twisted.web.client import getPage
+from dispatch import handles, dispatchTable
+from replay import DIRECTION_IN, DIRECTION_OUT
+from profiler import getProfiler
+from login import getLoginClient
+from lobby import Lobby, parseFilter
 
 STATE_LOGIN = "login"
 STATE_SEARCH = "search"
 STATE_JOIN = "join"
 STATE_PLAYING = "playing"
 
+# handlers of a state without any registered handler
+_NO_HANDLERS = {}
+_profiler = getProfiler()
+
+
+class NullScreen(object):
+    """screen that throws away all lines, for running the protocol without a terminal"""
+
+    def addLine(self, text):
+        pass
+
+    def _log_into_file(self, text):
+        pass
+
+    def flush(self):
+        pass
+
 
 class PokerClientProtocol(UGAMEClientProtocol):
+    # subclasses can use their own Table (e.g. with additional packet handlers)
+    table_class = Table
+    # seconds between two requests of the table list
+    lobby_refresh = 30.0
+    # BinaryLogWriter the packets are logged to as well (see binlog.py)
+    binlog = None
+    # LatencyTracker that times the actions (see latency.py)
+    latency = None
+
     def __init__(self, screenObj, msgpokerurl):
         UGAMEClientProtocol.__init__(self)
         self.screenObj = screenObj
         self.screenObj.executeCmd = self.executeCmd
         self.state = STATE_LOGIN
+        self._handlers = dispatchTable(self.__class__).get(self.state, _NO_HANDLERS)
         self.avatar = Player()
-        self.table = NoneTable()
+        # game_id: Table of every table joined over this connection
+        self.tables = {}
+        self._none_table = NoneTable()
 
+        # the current table, commands without @<game_id> act on it
         self.game_id = -1
         self.msgpokerurl = msgpokerurl
+        # auth key and email of the login at the site (see login.py)
+        self._auth = None
+        self._email = None
+        # game_id of the tables to join again after a reconnect
+        self._rejoin = []
+        # the tables of the table list
+        self.lobby = Lobby()
+        self._table_type = ""
+        self._lobby_call = None
+
+    @property
+    def table(self):
+        """the current table, the NoneTable if it was not joined (yet)"""
+        return self.tables.get(self.game_id, self._none_table)
 
     def logIt(self, astr, show_it=True, prefix=" [D] "):
         if show_it:
@@ -31,28 +79,10 @@ class PokerClientProtocol(UGAMEClientProtocol):
         else:
             self.screenObj._log_into_file(prefix + str(astr))
 
-    def cantHandle(self, handler, name):
-        return
-        # the following lines are still here to activate the debug lines easily again
-        if name not in (
-                'PacketPokerSit',
-                'PacketPokerPlayerChips',
-                'PacketPokerSeats',
-                'PacketPokerPlayerArrive',
-                'PacketPokerPlayerLeave',
-                'PacketPokerRebuy',
-                'PacketPokerSitOut',
-                'PacketPokerInGame',
-                'PacketPokerDealer',
-                'PacketPokerStart',
-            ):
-            self.logIt("%s can't handle %r" % (handler, name))
-
-    def myPosition(self):
-        serial = self.avatar.serial
-        if serial == -1 or serial not in self.table.in_game:
-            return
-        return self.table.in_game.index(serial)
+    def myPosition(self, table=None):
+        if table is None:
+            table = self.table
+        return table.positionOf(self.avatar.serial)
 
     def changeState(self, state):
         if self.state == STATE_LOGIN:
@@ -61,10 +91,20 @@ class PokerClientProtocol(UGAMEClientProtocol):
             assert state in (STATE_LOGIN, STATE_JOIN)
         self.logIt("changeState from %s to %s" % (self.state, state))
         self.state = state
+        self._handlers = dispatchTable(self.__class__).get(state, _NO_HANDLERS)
 
     def executeCmd(self, cmd):
         self.logIt(cmd, prefix=">>> ")
-        _serial_and_game_id = dict(serial=self.avatar.serial, game_id=self.game_id)
+        args = cmd.split()
+        # "@<game_id>" picks the table the command acts on
+        game_id = self.game_id
+        for arg in args[1:]:
+            if arg.startswith("@") and arg[1:].isdigit():
+                args.remove(arg)
+                game_id = int(arg[1:])
+                break
+        table = self.tables.get(game_id, self._none_table)
+        _serial_and_game_id = dict(serial=self.avatar.serial, game_id=game_id)
         def do_join(table_serial, *args):
             #self.logIt("join %s" % (table_serial,))
             # import rpdb2; rpdb2.start_embedded_debugger("haha")
@@ -81,85 +121,121 @@ class PokerClientProtocol(UGAMEClientProtocol):
             self.sendPacket(networkpackets.PacketPokerSeat(seat=seat, **_serial_and_game_id))
         do_s = do_seat
         def do_pp(*args):
-            if self.table:
-                self.table._log_players()
+            if table:
+                table._log_players()
         def do_bi(*args):
             # import rpdb2; rpdb2.start_embedded_debugger("haha")
-            self.table.doBuyIn()
-            self.table.doSit()
+            table.doBuyIn()
+            table.doSit()
         do_buy_in = do_bi
         def do_l(*args):
-            if len(args) >= 2:
-                email = args.pop(0)
-                pw = args.pop(0)
-            else:
+            if len(args) < 2:
                 self.logIt("Error no email and password specified")
                 self.logIt("l <email> <password>")
-
-            def ok(raw_resp):
-                try:
-                    self.logIt("ok")
-                    for line in raw_resp.splitlines():
-                        self.logIt(line)
-                    resp = simplejson.loads(raw_resp)
-                    self._auth = resp['auth_key']
-                    self.sendPacket(packets.PacketAuth(auth=self._auth))
-
-                except:
-                    exc_type, exc_value, exc_traceback = sys.exc_info()
-                    self.screenObj.addLine(" EEE  login failed: " + repr(cmd))
-
-                    for exline in traceback.format_exception(exc_type, exc_value,
-                                                  exc_traceback):
-                        for line in exline.split('\n'):
-                            self.screenObj.addLine(" EEE " + str(line))
-            d = getPage(self.msgpokerurl+"/site/login?api_key=special-key",
-                method='POST',
-                postdata=simplejson.dumps({
-                    'email': email,
-                    'password': pw,
-                    'rememberMe': False }),
-                headers={'Content-Type':'application/json'})
-            def err(reaseon):
-                self.logIt(str(reason), prefix="EEE")
-            d.addCallback(ok)
-            d.addErrback(err)
-            self.logIt("getPage")
+                return
+            email, pw = args[:2]
+
+            def ok(auth_key):
+                self._auth = auth_key
+                self._email = email
+                self.sendPacket(packets.PacketAuth(auth=self._auth))
+            def err(reason):
+                self.screenObj.addLine(" EEE  login failed: " + repr(cmd))
+                for line in reason.getTraceback().split('\n'):
+                    self.screenObj.addLine(" EEE " + str(line))
+            d = getLoginClient(self.msgpokerurl).login(email, pw)
+            d.addCallbacks(ok, err)
 
 
         def do_le(*args):
-            self.table.doFold()
-            self.table.doQuit()
+            table.doFold()
+            table.doQuit()
+            self.removeTable(game_id)
+        do_leave = do_le
         def do_so(*args):
-            self.table.doSitOut()
+            table.doSitOut()
         def do_si(*args):
-            self.table.doSit()
+            table.doSit()
         def do_ch(*args):
-            self.table.doCheck()
+            table.doCheck()
         def do_c(*args):
-            self.table.doCall()
+            table.doCall()
         do_call = do_c
         def do_f(*args):
-            self.table.doFold()
+            table.doFold()
         do_fold = do_f
         def do_r(amount, *args):
-            self.table.doRaise(int(amount))
+            table.doRaise(int(amount))
         do_raise = do_r
         def do_rebuy(*args):
             if len(args) > 0:
                 amount = int(args[0])
             else:
-                amount = self.table.max_buy_in
-            self.table.doRebuy(amount)
+                amount = table.max_buy_in
+            table.doRebuy(amount)
         def do_ci(*args):
-            self.logIt(self.table.getAvatarInfo())
+            self.logIt(table.getAvatarInfo())
         def do_all_in(*args):
-            self.table.doAllIn()
+            table.doAllIn()
+        def do_focus(*args):
+            if args:
+                self.game_id = int(args[0])
+            for joined in sorted(self.tables):
+                self.logIt("%s%d %s" % ("*" if joined == self.game_id else " ", joined, self.tables[joined].name))
+        def do_tables(*args):
+            # tables [filter] [sort], e.g. tables free>0,stakes<=200 -hands_per_hour
+            filter_, sort = "", None
+            for arg in args:
+                if any(symbol in arg for symbol in "<>=~"):
+                    filter_ = arg
+                else:
+                    sort = arg
+            try:
+                tables = self.lobby.select(parseFilter(filter_), sort)
+            except ValueError, e:
+                self.logIt(e, prefix=" [_] ")
+                return
+            for lobby_table in tables:
+                self.logIt(lobby_table, prefix=" [_] ")
+            self.logIt("%d of %d tables" % (len(tables), len(self.lobby)), prefix=" [_] ")
+        def do_eq(*args):
+            if not table or not table.avatar.cards:
+                self.logIt("no cards, no equity")
+                return
+            opponents = int(args[0]) if len(args) > 0 else table.opponents()
+            iterations = int(args[1]) if len(args) > 1 else 100000
+            d = table.estimateEquity(opponents, iterations)
+            def show(equity):
+                self.logIt("equity vs %d opponents: %s" % (opponents, equity), prefix=" $ ")
+            def err(reason):
+                self.logIt(str(reason), prefix=" EEE ")
+            d.addCallbacks(show, err)
+        def do_prof(action="dump", *args):
+            if action == "on":
+                _profiler.start()
+            elif action == "off":
+                _profiler.stop()
+            elif action == "reset":
+                _profiler.reset()
+            elif action == "dump":
+                for line in _profiler.report():
+                    self.logIt(line, prefix=" % ")
+                if args:
+                    _profiler.dump(args[0])
+                    self.logIt("profile written to %s" % args[0])
+            elif action == "cprofile":
+                seconds = float(args[0]) if len(args) > 0 else 30
+                filename = args[1] if len(args) > 1 else "pokercli-%d.pstats" % time.time()
+                def done(filename):
+                    self.logIt("cProfile stats written to %s" % filename, prefix=" % ")
+                _profiler.startCProfile(seconds, filename, done)
+                self.logIt("cProfile for %gs" % seconds, prefix=" % ")
+            else:
+                self.logIt("prof on|off|reset|dump [file]|cprofile <seconds> [file]")
         def default(commando, *args):
             self.logIt("commando %r unknown" % commando)
 
         #self.logIt(cmd)
-        args = cmd.split()
         commando = args.pop(0)
         try:
             handle = locals()["do_"+commando]
@@ -177,116 +253,150 @@ class PokerClientProtocol(UGAMEClientProtocol):
     def getDebugLines(self):
         return self.table.getDebugLines()
 
-    def addTable(self, table_info):
-        blinds, buy_ins, limit = table_info.betting_structure.split('_')
-        min_buy_in, max_buy_in = buy_ins.split('-')
-        info = " id=%s\t%-20s\t%s" % (table_info.id, table_info.name, table_info.betting_structure)
-        print_ = False
-        if int(max_buy_in) < 5000:
-            print_ = True        
-        self.logIt(str(info), show_it=print_, prefix=" [_] ")
+    def lobbyUpdated(self, added, changed, removed):
+        """the table list arrived, the ids of the tables that were added, changed and removed are given"""
+        for table_id in added:
+            self.logIt(self.lobby.tables[table_id], show_it=False, prefix=" [_] ")
+        self.logIt("%d tables (%d new, %d changed, %d gone), see: tables [filter] [sort]" % (
+            len(self.lobby), len(added), len(changed), len(removed)), show_it=bool(added or removed), prefix=" [_] ")
+
+    def startLobbyRefresh(self):
+        """ask for the table list every lobby_refresh seconds"""
+        self._lobby_call = task.LoopingCall(self.refreshLobby)
+        self._lobby_call.start(self.lobby_refresh, now=False)
 
-    def itsYourTurn(self):
-        self.logIt("Your Turn POSITION: " + self.table.getAvatarInfo(), prefix=" $ ")
+    def refreshLobby(self):
+        if self.state != STATE_LOGIN:
+            self.sendPacket(networkpackets.PacketPokerTableSelect(string=self._table_type))
+
+    def itsYourTurn(self, table=None):
+        if table is None:
+            table = self.table
+        self.logIt("Your Turn POSITION: " + table.getAvatarInfo(), prefix=" $ ")
 
     def createTable(self, table_info):
-        self.table = Table(self, self.avatar, table_info)
+        """returns the new table, it becomes the current one"""
+        table = self.tables[table_info['id']] = self.table_class(self, self.avatar, table_info)
+        self.game_id = table.id
+        return table
+
+    def removeTable(self, game_id):
+        """forget the table, another one becomes the current one"""
+        self.tables.pop(game_id, None)
+        if game_id == self.game_id:
+            self.game_id = min(self.tables) if self.tables else -1
 
     def defaultHandler(self, packet):
-        self.table.explain(packet, self.state)
-
-    def handleLogin(self, packet):
-        if packet.type == packets.PACKET_AUTH_OK:
-            self.sendPacket(networkpackets.PacketPokerSetRole(roles="PLAY"))
-            self.changeState(STATE_SEARCH)
-        elif packet.type == packets.PACKET_AUTH_REFUSED:
-            # :( inform about the problem ):
-            pass
-        return False
-
-    def handleSearch(self, packet):
-        def handlePacketSerial(packet):
-            serial = packet.serial
-            self.avatar.serial = serial
-            self.sendPacket(networkpackets.PacketPokerGetPlayerInfo())
-            self.sendPacket(networkpackets.PacketPokerGetUserInfo(serial=serial))
-        def handlePacketPokerPlayerInfo(packet):
-            # you could update, your name/outfit/url
-            pass
-        def handlePacketPokerUserInfo(packet):
-            self.avatar.updateMoney(packet.money)
-            table_type = "%s\tholdem" % "1" if 1 in self.avatar.money else ""
-            self.sendPacket(networkpackets.PacketPokerTableSelect(string=table_type))
-        def handlePacketPokerTableList(packet):
-            for p in packet.packets:
-                self.addTable(p)
-        def handlePacketPokerTable(packet):
-            """ table join was successfull"""
-            self.createTable(packet.__dict__)
+        """let the table of the packet explain it, packets without game_id go to the current table"""
+        table = self.tables.get(getattr(packet, "game_id", self.game_id))
+        if table is not None:
+            table.explain(packet, self.state)
+
+    @handles(packets.PACKET_AUTH_OK, state=STATE_LOGIN)
+    def handlePacketAuthOk(self, packet):
+        self.sendPacket(networkpackets.PacketPokerSetRole(roles="PLAY"))
+        self.changeState(STATE_SEARCH)
+
+    @handles(packets.PACKET_AUTH_REFUSED, state=STATE_LOGIN)
+    def handlePacketAuthRefused(self, packet):
+        # :( inform about the problem ):
+        if self._email is not None:
+            # the cached auth key is not good anymore, the next login asks the site
+            getLoginClient(self.msgpokerurl).invalidate(self._email)
+            self._email = None
+
+    @handles(packets.PACKET_SERIAL, state=STATE_SEARCH)
+    def handlePacketSerial(self, packet):
+        serial = packet.serial
+        self.avatar.serial = serial
+        self.sendPacket(networkpackets.PacketPokerGetPlayerInfo())
+        self.sendPacket(networkpackets.PacketPokerGetUserInfo(serial=serial))
+
+    @handles(networkpackets.PACKET_POKER_PLAYER_INFO, state=STATE_SEARCH)
+    def handlePacketPokerPlayerInfo(self, packet):
+        # you could update, your name/outfit/url
+        pass
+
+    @handles(networkpackets.PACKET_POKER_USER_INFO, state=STATE_SEARCH)
+    def handlePacketPokerUserInfo(self, packet):
+        self.avatar.updateMoney(packet.money)
+        if self._rejoin:
+            # back after a reconnect: join the tables again instead of asking the lobby, the money is
+            # known before the first table arrives. The server sends the state of the tables
+            for game_id in self._rejoin:
+                self.sendPacket(networkpackets.PacketPokerTableJoin(serial=self.avatar.serial, game_id=game_id))
+            self._rejoin = []
+            return
+        self._table_type = "%s\tholdem" % "1" if 1 in self.avatar.money else ""
+        self.sendPacket(networkpackets.PacketPokerTableSelect(string=self._table_type))
+
+    @handles(networkpackets.PACKET_POKER_TABLE_LIST, state=STATE_SEARCH)
+    @handles(networkpackets.PACKET_POKER_TABLE_LIST, state=STATE_JOIN)
+    @handles(networkpackets.PACKET_POKER_TABLE_LIST, state=STATE_PLAYING)
+    def handlePacketPokerTableList(self, packet):
+        self.lobbyUpdated(*self.lobby.update(packet.packets))
+
+    @handles(networkpackets.PACKET_POKER_TABLE, state=STATE_SEARCH)
+    @handles(networkpackets.PACKET_POKER_TABLE, state=STATE_JOIN)
+    @handles(networkpackets.PACKET_POKER_TABLE, state=STATE_PLAYING)
+    def handlePacketPokerTable(self, packet):
+        """ table join was successfull"""
+        self.createTable(packet.__dict__)
+        if self.state == STATE_SEARCH:
             self.changeState(STATE_JOIN)
-        try:
-            handle = locals()["handle"+packet.__class__.__name__]
-            handle(packet)
-            return False
-        except KeyError:
-            self.cantHandle("Search", packet.__class__.__name__)
-            return True
-
-    def handleJoin(self, packet):
-        def handlePacketPokerBuyInLimits(packet):
-            return True
-        # def handlePacketPokerBatchMode(packet):
-        #     self.changeState(STATE_BATCH)
-        def handlePacketPokerStart(packet):
-            self.changeState(STATE_PLAYING)
-        try:
-            handle = locals()["handle"+packet.__class__.__name__]
-            handle(packet)
-            return False
-        except KeyError:
-            self.cantHandle("Join", packet.__class__.__name__)
-            return True
-
-    def handlePlaying(self, packet):
-        def handlePacketPokerPosition(packet):
-            self.logIt("POSITION pp:%s, mp:%s, chips:%s" % (packet.position,self.myPosition(), self.avatar.getChips()))
-            if packet.position == self.myPosition():
-                self.itsYourTurn()
-        try:
-            handle = locals()["handle"+packet.__class__.__name__]
-            handle(packet)
-            return False
-        except KeyError:
-            self.cantHandle("Playing", packet.__class__.__name__)
-            return True
-    # def handleBatch(self, packet):
-    #     def handlePacketPokerStreamMode(packet):
-    #         self.changeState(STATE_JOIN)
-    #     try:
-    #         handle = locals()["handle"+packet.__class__.__name__]
-    #         handle(packet)
-    #         return False
-    #     except KeyError:
-    #         self.cantHandle("Batch", packet.__class__.__name__)
-    #         return self.handleJoin(packet)
-
-    def _get_handler(self, state):
-        try:
-            return getattr(self, "handle" + state.capitalize())
-        except:
-            return self.defaultHandler
+
+    @handles(networkpackets.PACKET_POKER_BUY_IN_LIMITS, state=STATE_JOIN)
+    def handlePacketPokerBuyInLimits(self, packet):
+        pass
+
+    @handles(networkpackets.PACKET_POKER_START, state=STATE_JOIN)
+    def handlePacketPokerStart(self, packet):
+        self.changeState(STATE_PLAYING)
+        self.defaultHandler(packet)
+
+    @handles(networkpackets.PACKET_POKER_POSITION, state=STATE_PLAYING)
+    def handlePacketPokerPosition(self, packet):
+        table = self.tables.get(packet.game_id)
+        if table is None:
+            return
+        # the table keeps track of the position
+        self.defaultHandler(packet)
+        position = self.myPosition(table)
+        self.logIt("POSITION pp:%s, mp:%s, chips:%s" % (packet.position, position, table.avatar.getChips()))
+        if packet.position == position:
+            self.itsYourTurn(table)
 
     def _handleConnection(self, packet):
         """get packets from server"""
-        self.screenObj.addLine("> " + str(packet))
+        if _profiler.enabled:
+            _profiler.measure(self, packet)
+            return
+        self._logReceived(packet)
+        self.handlePacket(packet)
 
-        if self._get_handler(self.state)(packet):
+    def _logReceived(self, packet):
+        self.screenObj.addLine("> " + str(packet))
+        if self.binlog is not None:
+            self.binlog.write(DIRECTION_IN, packet)
+        if self.latency is not None:
+            self.latency.packetReceived(packet)
+
+    def handlePacket(self, packet):
+        """let the handler of the current state or the table handle the packet"""
+        handler = self._handlers.get(packet.type)
+        if handler is not None:
+            handler(self, packet)
+        elif self.state != STATE_LOGIN:
             self.defaultHandler(packet)
 
     def sendPacket(self, packet):
         try:
             UGAMEClientProtocol.sendPacket(self, packet)
             self.screenObj.addLine("< " + str(packet))
+            if self.binlog is not None:
+                self.binlog.write(DIRECTION_OUT, packet)
+            if self.latency is not None:
+                self.latency.packetSent(packet)
         except Exception:
             exc_type, exc_value, exc_traceback = sys.exc_info()
             self.screenObj.addLine(" EEE  sendPacket failed: " + str(packet))
@@ -296,10 +406,34 @@ class PokerClientProtocol(UGAMEClientProtocol):
                 for line in exline.split('\n'):
                     self.screenObj.addLine(" EEE " + str(line))
 
+    def connectionLost(self, reason):
+        if self._lobby_call is not None and self._lobby_call.running:
+            self._lobby_call.stop()
+        UGAMEClientProtocol.connectionLost(self, reason)
+        # nothing logged for this connection should get lost in a buffer
+        self.screenObj.flush()
+        if self.binlog is not None:
+            self.binlog.flush()
+
     def botLogin(self, name, password):
         """login for bots"""
         self.sendPacket(packets.PacketLogin(name=name, password=password))
 
+    def resumeInfo(self):
+        """returns what a new connection needs to pick up where this one was lost, None if it did not log in"""
+        if self.state == STATE_LOGIN:
+            return None
+        return dict(auth=self._auth, email=self._email, game_ids=sorted(self.tables), game_id=self.game_id)
+
+    def resume(self, info):
+        """log in with the auth key of the lost connection (bots log in by themselves) and join its tables again"""
+        self._rejoin = info['game_ids']
+        self.game_id = info['game_id']
+        if info['auth'] is not None:
+            self._auth = info['auth']
+            self._email = info['email']
+            self.sendPacket(packets.PacketAuth(auth=self._auth))
+
 class PokerFactory(UGAMEClientFactory):
 
     """
@@ -307,13 +441,33 @@ class PokerFactory(UGAMEClientFactory):
     """
 
     protocol = PokerClientProtocol
+    # seconds before the first reconnect, doubled (up to max_reconnect_delay) while reconnecting fails
+    reconnect_delay = 1.0
+    max_reconnect_delay = 60.0
+    # the delay is randomized by this fraction, so many clients do not reconnect all at once
+    reconnect_jitter = 0.5
 
-    def __init__(self, screenObj, msgpokerurl):
+    def __init__(self, screenObj, msgpokerurl, binlog=None, latency=None):
         UGAMEClientFactory.__init__(self)
         self.screenObj = screenObj
         self.protocol = PokerClientProtocol
-        self.established_deferred.addCallback(self.letsGo)
+        self.established_deferred.addCallback(self._established)
         self.msgpokerurl = msgpokerurl
+        self.binlog = binlog
+        self.latency = latency
+        self.reconnect = True
+        # resumeInfo() of the last connection that got lost
+        self.resume = None
+        self._delay = self.reconnect_delay
+        self._reconnect_call = None
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stopReconnecting)
+
+    def _established(self, protocol):
+        self._delay = self.reconnect_delay
+        protocol.startLobbyRefresh()
+        if self.resume is not None:
+            protocol.resume(self.resume)
+        self.letsGo(protocol)
 
     def letsGo(self, protocol):
         # protocol.sendPacket(packets.PacketLogin(name="testuser", password="testpass"))
@@ -324,9 +478,39 @@ class PokerFactory(UGAMEClientFactory):
     def buildProtocol(self, addr=None):
         instance = self.protocol(self.screenObj, self.msgpokerurl)
         instance.factory = self
+        instance.binlog = self.binlog
+        instance.latency = self.latency
         self.protocol_instance = instance
         self.screenObj._p = instance
         return instance
 
-    def clientConnectionLost(self, conn, reason):
-        pass
\ No newline at end of file
+    def clientConnectionLost(self, connector, reason):
+        info = self.protocol_instance.resumeInfo()
+        if info is not None:
+            self.resume = info
+        self.retry(connector, reason)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.retry(connector, reason)
+
+    def retry(self, connector, reason):
+        """connect again after the (growing) delay"""
+        if not self.reconnect:
+            return
+        delay = self._delay * random.uniform(1 - self.reconnect_jitter, 1 + self.reconnect_jitter)
+        self._delay = min(self._delay * 2, self.max_reconnect_delay)
+        self.screenObj.addLine("connection lost (%s), reconnect in %.1fs" % (reason.getErrorMessage(), delay))
+        self._reconnect_call = reactor.callLater(delay, self._reconnect, connector)
+
+    def _reconnect(self, connector):
+        self._reconnect_call = None
+        # the deferred fired for the lost connection already
+        self.established_deferred = defer.Deferred()
+        self.established_deferred.addCallback(self._established)
+        connector.connect()
+
+    def stopReconnecting(self):
+        self.reconnect = False
+        if self._reconnect_call is not None and self._reconnect_call.active():
+            self._reconnect_call.cancel()
+        self._reconnect_call = None
\ No newline at end of file
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+precomputed preflop equities of the 169 starting hand classes
+
+The table is generated offline with PokerEval and written to a small binary
+file, the client and the bots memory map it and look equities up in O(1).
+
+    python preflop.py [file] [iterations]
+
+file format (little endian):
+    header  magic "PFEQ", version (H), hand classes (H), max opponents (H),
+            iterations per entry (I), crc32 of the entries (I)
+    entries one (win, tie) pair of uint16 (probability * 65535) for every
+            hand class and 1 .. max opponents, ordered by class then opponents
+"""
+import os, sys, mmap, struct, zlib
+
+MAGIC = "PFEQ"
+VERSION = 1
+HAND_CLASSES = 169
+MAX_OPPONENTS = 9
+DEFAULT_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "preflop.eq")
+
+_header = struct.Struct("<4sHHHII")
+_entry = struct.Struct("<HH")
+_table = None
+
+
+class PreflopTableError(Exception):
+    pass
+
+
+def handClass(card1, card2):
+    """returns the index (0..168) of the starting hand class of two cards (pokereval numbers)"""
+    rank1, rank2 = card1 % 13, card2 % 13
+    high, low = max(rank1, rank2), min(rank1, rank2)
+    if card1 // 13 == card2 // 13:
+        # suited hands above the pairs on the diagonal, offsuit hands below
+        return high * 13 + low
+    return low * 13 + high
+
+def representativeHand(hand_class):
+    """returns two cards of the hand class"""
+    row, column = divmod(hand_class, 13)
+    if row > column:
+        # suited, both hearts
+        return [row, column]
+    return [row, 13 + column]
+
+
+class PreflopTable(object):
+    """read only, memory mapped preflop equity table"""
+
+    def __init__(self, filename=DEFAULT_FILENAME):
+        self.filename = filename
+        with open(filename, "rb") as fd:
+            # an empty file can not be mapped (an interrupted generate could leave one)
+            if os.fstat(fd.fileno()).st_size < _header.size:
+                raise PreflopTableError("%s: file too short" % filename)
+            self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, classes, self.max_opponents, self.iterations, crc = _header.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise PreflopTableError("%s: no preflop table of version %d" % (filename, VERSION))
+        if classes != HAND_CLASSES or len(self._map) != _header.size + classes * self.max_opponents * _entry.size:
+            raise PreflopTableError("%s: unexpected size" % filename)
+        if zlib.crc32(self._map[_header.size:]) & 0xffffffff != crc:
+            raise PreflopTableError("%s: checksum mismatch" % filename)
+
+    def lookup(self, card1, card2, opponents):
+        """returns (win, tie) probabilities of the hole cards against opponents random hands"""
+        opponents = min(max(opponents, 1), self.max_opponents)
+        offset = _header.size + (handClass(card1, card2) * self.max_opponents + opponents - 1) * _entry.size
+        win, tie = _entry.unpack_from(self._map, offset)
+        return win / 65535.0, tie / 65535.0
+
+    def equity(self, card1, card2, opponents):
+        """returns the share of the pot the hole cards win on average (ties counted half)"""
+        win, tie = self.lookup(card1, card2, opponents)
+        return win + tie / 2
+
+    def close(self):
+        self._map.close()
+
+
+def getPreflopTable(filename=DEFAULT_FILENAME):
+    """returns the table of the process (mapped on the first call) or None if there is no valid table"""
+    global _table
+    if _table is None:
+        try:
+            _table = PreflopTable(filename)
+        except (EnvironmentError, ValueError, PreflopTableError):
+            _table = False
+    return _table or None
+
+def generate(filename=DEFAULT_FILENAME, iterations=100000, max_opponents=MAX_OPPONENTS, progress=None):
+    """simulate every hand class against 1 .. max_opponents random hands and write the table"""
+    from pokereval import PokerEval
+    pokereval = PokerEval()
+    entries = []
+    for hand_class in range(HAND_CLASSES):
+        hand = representativeHand(hand_class)
+        for opponents in range(1, max_opponents + 1):
+            pockets = [hand] + [[255, 255] for _ in range(opponents)]
+            result = pokereval.poker_eval(game="holdem", pockets=pockets, board=[255] * 5, dead=[], iterations=iterations)
+            samples = float(result['info'][0])
+            hero = result['eval'][0]
+            entries.append(_entry.pack(int(round(hero['winhi'] / samples * 65535)), int(round(hero['tiehi'] / samples * 65535))))
+        if progress:
+            progress(hand_class + 1)
+    payload = "".join(entries)
+    tmpfilename = filename + ".tmp"
+    with open(tmpfilename, "wb") as fd:
+        fd.write(_header.pack(MAGIC, VERSION, HAND_CLASSES, max_opponents, iterations, zlib.crc32(payload) & 0xffffffff))
+        fd.write(payload)
+    os.rename(tmpfilename, filename)
+
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FILENAME
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    def progress(done):
+        sys.stdout.write("\r%d/%d hand classes" % (done, HAND_CLASSES))
+        sys.stdout.flush()
+    generate(filename, iterations, progress=progress)
+    print
+    print "written", filename
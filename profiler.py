@@ -0,0 +1,115 @@
+"""
+cpu time of the packets the client receives
+
+While the profiler is on, every packet going through
+PokerClientProtocol._handleConnection is timed: the logging of the packet and
+the handler (the handler of the state or Table.explain) are counted per packet
+class. A cProfile session can be run over a time window on top of it.
+
+    prof on | off | reset | dump [file]
+    prof cprofile <seconds> [file.pstats]
+"""
+import cProfile, time
+from timeit import default_timer
+from twisted.internet import reactor
+
+_profiler = None
+
+
+class PacketStats(object):
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.handler = 0.0
+        self.max = 0.0
+
+
+class PacketProfiler(object):
+    """counts and times the received packets per packet class, use getProfiler() to get the one of the process"""
+
+    def __init__(self):
+        self.enabled = False
+        # (packet class name, "state" or "table"): PacketStats
+        self.stats = {}
+        self.started = None
+        self.elapsed = 0.0
+        self._cprofile = None
+
+    def start(self):
+        if not self.enabled:
+            self.enabled = True
+            self.started = time.time()
+
+    def stop(self):
+        if self.enabled:
+            self.enabled = False
+            self.elapsed += time.time() - self.started
+
+    def reset(self):
+        self.stats = {}
+        self.elapsed = 0.0
+        self.started = time.time()
+
+    def measure(self, protocol, packet):
+        """let the protocol log and handle the packet and count the time it took"""
+        where = "state" if packet.type in protocol._handlers else "table"
+        start = default_timer()
+        protocol._logReceived(packet)
+        logged = default_timer()
+        protocol.handlePacket(packet)
+        end = default_timer()
+        key = (packet.__class__.__name__, where)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = PacketStats()
+        stats.count += 1
+        stats.total += end - start
+        stats.handler += end - logged
+        stats.max = max(stats.max, end - start)
+
+    def report(self):
+        """returns the lines of the report, the most expensive packets first"""
+        elapsed = self.elapsed + (time.time() - self.started if self.enabled else 0)
+        lines = ["%-32s %-5s %8s %10s %10s %9s %9s" % ("packet", "by", "count", "total ms", "handler ms", "mean us", "max ms")]
+        total = 0.0
+        for (name, where), stats in sorted(self.stats.iteritems(), key=lambda item: -item[1].total):
+            total += stats.total
+            lines.append("%-32s %-5s %8d %10.1f %10.1f %9.1f %9.2f" % (
+                name, where, stats.count, stats.total * 1000, stats.handler * 1000,
+                stats.total / stats.count * 1000000, stats.max * 1000))
+        lines.append("%.1f ms in %.0f s profiled (%.2f%% cpu)" % (total * 1000, elapsed, total / elapsed * 100 if elapsed else 0))
+        return lines
+
+    def dump(self, filename):
+        with open(filename, "w") as fd:
+            for line in self.report():
+                fd.write(line + "\n")
+
+    def isProfiling(self):
+        """returns True while a cProfile session runs"""
+        return self._cprofile is not None
+
+    def startCProfile(self, seconds, filename, done=None):
+        """profile everything the reactor does for the next seconds, the stats are dumped to filename
+        and done is called with the filename"""
+        if self._cprofile is not None:
+            raise RuntimeError("a cProfile session is running already")
+        self._cprofile = cProfile.Profile()
+        self._cprofile.enable()
+        reactor.callLater(seconds, self._stopCProfile, filename, done)
+
+    def _stopCProfile(self, filename, done):
+        profile, self._cprofile = self._cprofile, None
+        profile.disable()
+        profile.dump_stats(filename)
+        if done is not None:
+            done(filename)
+
+
+def getProfiler():
+    """returns the profiler shared by the whole process"""
+    global _profiler
+    if _profiler is None:
+        _profiler = PacketProfiler()
+    return _profiler
@@ -1,12 +1,47 @@
+"""
+turns logged packets (str(packet), as written by the client) back into packets
+
+    > POKER_TABLE  type = 73 length = 103 id = 28 seats = 9 ...
+
+Log files are parsed as a stream, line by line. The fields of a line are found
+by a compiled tokenizer, and the field converters of a packet type are looked up
+only once per type.
+"""
+import re
 from pokerpackets.packets import *
 from pokerpackets.networkpackets import *
 
 class PacketNotFoundError(Exception): pass
-        
+
+# direction prefixes of the log lines
+DIRECTION_IN = "> "
+DIRECTION_OUT = "< "
+
+# the start of a field: " name = "
+_FIELD = re.compile(r"(?:^|\s)(\w+) =(?: |$)")
+_BRACKET = re.compile(r"[\[\]]")
+# separators of the packets in a list of packets, and brackets to know the nesting depth
+_LIST_TOKEN = re.compile(r"[\[\]]|, (?=[A-Z][A-Z0-9_]* )")
+_PACKET_LINE = re.compile(r"([<>]) ([A-Z][A-Z0-9_]*) ")
+
+_CONVERTERS = {
+    "I": int,
+    "B": int,
+    "Bnone": lambda x:int(x) if x not in ("255", "None") else None,
+    "Q": int,
+    "H": int,
+    "b": int,
+    "h": int,
+    "i": int,
+    "q": int,
+    "bool": lambda x: x == "True",
+}
+# packet name: (packet class, {field: converter or None})
+_plans = {}
+
 
 def getPacketFromString(astring):
     name, rest = astring.split(" ",1)
-    print name, repr(rest)
     params = getParamsFromString(rest)
     return convertToPacket(name, params)
 
@@ -19,71 +54,110 @@ def getParamsFromString(paramString):
         >>> getParamsFromString("multiword = this is a sample foo = bar")
         {"multiword": "this is a sample", "foo": "bar"}
     """
+    text = paramString.strip()
+    if "[" not in text:
+        # no lists, the fields can be split in one go: ['', name, value, name, value, ...]
+        fields = _FIELD.split(text)
+        return dict(zip(fields[1::2], fields[2::2]))
     params = {}
-    rest = paramString.strip()
-    next_equal = 1
-    while next_equal >= 0:
-        name, rest = rest.split(" ",1)
-        # print name, repr(rest)
-        assert rest.startswith("="), repr(rest[:20])
-        _, rest = rest.split(" ",1)
-        if rest.startswith("["):
-            end = rest.find("]")
-            packets = rest[1:end ].split(', ')
-            if packets[0].isdigit():
-                value = list(map(int, packets))
-            else:
-                value = [getPacketFromString(packet) for packet in packets]
-            rest = rest[end+1:].strip()
-            next_equal = rest.find("=")
-            # print repr(rest)
-            
+    match = _FIELD.search(text)
+    while match:
+        name, start = match.group(1), match.end()
+        if text.startswith("[", start):
+            end = _closingBracket(text, start)
+            params[name] = _listValue(text[start+1:end])
+            match = _FIELD.search(text, end + 1)
         else:
-            next_equal = rest.find("=")
-            if next_equal == -1:
-                value = rest
-            else:
-                tmp = rest[:next_equal-1][::-1].find(" ")
-                assert tmp != -1
-                value, rest = rest[:next_equal-2-tmp], rest[next_equal-1-tmp:]
-        params[name]=value
+            # values may contain spaces, they end where the next field starts
+            next_match = _FIELD.search(text, start)
+            params[name] = text[start:next_match.start() if next_match else len(text)]
+            match = next_match
     return params
 
-def clean(value, var_type):
-    # print "clean %-10s %r" % (var_type, value)
-    converter = {
-        "I": lambda x:int(x),
-        "B": lambda x:int(x),
-        "Bnone": lambda x:int(x) if x != 255 else None,
-        "Q": lambda x:int(x),
-        "bool": lambda x: x == "True",
-    }
+def _closingBracket(text, start):
+    """returns the index of the bracket closing the one at start"""
+    depth = 0
+    for bracket in _BRACKET.finditer(text, start):
+        depth += 1 if bracket.group() == "[" else -1
+        if depth == 0:
+            return bracket.start()
+    raise ValueError("unbalanced brackets: %r" % text[start:start+40])
 
-    if var_type in converter:
-        return converter[var_type](value)
+def _listValue(text):
+    """returns the list of ints or packets of the text between the brackets"""
+    if not text:
+        return []
+    if text[0].isdigit() or text[0] == "-":
+        return list(map(int, text.split(', ')))
+    packets = []
+    depth = start = 0
+    for token in _LIST_TOKEN.finditer(text):
+        separator = token.group()
+        if separator == "[":
+            depth += 1
+        elif separator == "]":
+            depth -= 1
+        elif depth == 0:
+            packets.append(getPacketFromString(text[start:token.start()]))
+            start = token.end()
+    packets.append(getPacketFromString(text[start:]))
+    return packets
 
-    return value
+def clean(value, var_type):
+    converter = _CONVERTERS.get(var_type)
+    if converter is None:
+        return value
+    return converter(value)
 
-def convertToPacket(name, params):
-    # print params
-    try:
-        packet_type = globals()["PACKET_" + name]
-    except KeyError:
-        raise PacketNotFoundError()
+def _plan(name):
+    """returns (packet class, {field: converter}) of the packet name, it is built once per name"""
+    plan = _plans.get(name)
+    if plan is None:
+        try:
+            packet_type = globals()["PACKET_" + name]
+        except KeyError:
+            raise PacketNotFoundError(name)
+        packet_class = PacketFactory[packet_type]
+        converters = dict((field, _CONVERTERS.get(var_type)) for field, _, var_type in packet_class.info)
+        plan = _plans[name] = (packet_class, converters)
+    return plan
 
-    packet = PacketFactory[packet_type]
+def convertToPacket(name, params):
+    packet_class, converters = _plan(name)
+    clean_params = {}
+    for field, value in params.iteritems():
+        converter = converters[field]
+        clean_params[field] = value if converter is None else converter(value)
+    return packet_class(**clean_params)
 
-    type_lookup = {}
-    for name, _, var_type in packet.info:
-        type_lookup[name]=var_type
+def parseLine(line):
+    """returns (direction, packet) of a logged packet line or None if the line is no packet"""
+    match = _PACKET_LINE.match(line)
+    if match is None:
+        return None
+    direction, name = match.groups()
+    return direction + " ", convertToPacket(name, getParamsFromString(line[match.end():]))
 
-    clean_params = {}
-    for name, value in params.items():
-        clean_params[name]=clean(value, type_lookup[name])
+def iterPackets(lines, strict=False):
+    """yields (direction, packet) for every packet in the lines, lines that are no (known) packets are skipped unless strict"""
+    for line in lines:
+        try:
+            parsed = parseLine(line.rstrip("\r\n"))
+        except Exception:
+            if strict:
+                raise
+            continue
+        if parsed is not None:
+            yield parsed
 
-    # print clean_params
-    return packet(**clean_params)
+def iterFile(filename, strict=False):
+    """yields (direction, packet) for every packet logged in the file, the file is read as a stream"""
+    with open(filename) as fd:
+        for parsed in iterPackets(fd, strict):
+            yield parsed
 
 
 if __name__ == "__main__":
-    packet = getPacketFromString("POKER_TABLE  type = 73 length = 103 id = 28 seats = 9 average_pot = 11315 hands_per_hour = 40 percent_flop = 58 players = 0 observers = 3 waiting = 0 player_timeout = 25 muck_timeout = 5 currency_serial = 1 name = Fish and Chips variant = holdem betting_structure = 1-2_10-100_1000-pokermania skin = default reason = TableJoin tourney_serial = 0 player_seated = -1")
+    import sys
+    from replayengine import main
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+rebuilds the games of a packet log without a server or a terminal
+
+The incoming packets of the log are fed into a headless PokerClientProtocol as
+fast as they can be parsed (binary logs, see binlog.py, are decoded instead). Every snapshot_every hands the state of the protocol
+and its tables are copied, so seeking to a hand restores the nearest snapshot in
+front of it and only replays the packets from there. With snapshot_every=None
+no snapshots are taken, seeking replays from the beginning.
+
+    python replay.py <log file> [--hand <hand_serial>] [--snapshot-every <hands>]
+"""
+import sys, time, copy, bisect
+from pokerpackets import networkpackets
+
+import replay, binlog
+from dispatch import dispatchTable
+from pokerprotocol import PokerClientProtocol, NullScreen, STATE_LOGIN
+
+
+class HeadlessProtocol(PokerClientProtocol):
+    """protocol without a connection, the packets it would send are dropped"""
+
+    def __init__(self, state=STATE_LOGIN):
+        PokerClientProtocol.__init__(self, NullScreen(), msgpokerurl="")
+        self.setState(state)
+
+    def setState(self, state):
+        """change the state without the checks of changeState (e.g. to start in the middle of a log)"""
+        self.state = state
+        self._handlers = dispatchTable(self.__class__).get(state, {})
+
+    def sendPacket(self, packet):
+        pass
+
+    def itsYourTurn(self, table=None):
+        pass
+
+
+class Snapshot(object):
+    """state of the protocol after the PacketPokerStart of a hand"""
+
+    def __init__(self, offset, hand_serial, protocol):
+        self.offset = offset
+        self.hand_serial = hand_serial
+        # the copied tables still refer to this protocol, it is replaced when restoring
+        self._protocol = protocol
+        self._state = copy.deepcopy(self._capture(protocol), {id(protocol): protocol})
+
+    def _capture(self, protocol):
+        return protocol.state, protocol.avatar, protocol.tables, protocol.game_id
+
+    def restore(self, protocol):
+        """put the state of the snapshot into the protocol, the snapshot can be restored again"""
+        state, protocol.avatar, protocol.tables, protocol.game_id = copy.deepcopy(self._state, {id(self._protocol): protocol})
+        protocol.setState(state)
+
+
+class ReplayEngine(object):
+    """feeds a log into a HeadlessProtocol, can seek to the start of every hand in the log"""
+
+    # subclasses can replay into their own protocol (e.g. with another table_class)
+    protocol_class = HeadlessProtocol
+
+    def __init__(self, filename, snapshot_every=50, state=STATE_LOGIN):
+        self.filename = filename
+        self.snapshot_every = snapshot_every
+        self.start_state = state
+        # hand_serial: offset behind the PacketPokerStart of the hand
+        self.hands = {}
+        self.snapshots = []
+        self._snapshot_offsets = []
+        self.lines = self.packets = self.errors = 0
+        # binary logs are read by records, the offsets are positions in the record stream
+        self._reader = binlog.BinaryLogReader(filename) if binlog.isBinaryLog(filename) else None
+        self._rewind()
+
+    def _rewind(self):
+        """start again at the beginning of the log"""
+        self.protocol = self.protocol_class(self.start_state)
+        self.offset = 0
+        self.hand_serial = None
+        self._hands_since_snapshot = self.snapshot_every
+
+    def _restore(self, snapshot):
+        snapshot.restore(self.protocol)
+        self.offset = snapshot.offset
+        self.hand_serial = snapshot.hand_serial
+        self._hands_since_snapshot = 0
+
+    def _iterPackets(self):
+        """yields the incoming packets behind the current offset, the offset is kept up to date"""
+        if self._reader is not None:
+            for record in self._reader.iterRecords(self.offset):
+                self.offset = record.end
+                self.lines += 1
+                # outgoing packets are never decoded
+                if record.direction != replay.DIRECTION_IN:
+                    continue
+                try:
+                    packet = record.packet
+                except Exception:
+                    self.errors += 1
+                    continue
+                yield packet
+            return
+        with open(self.filename, "rb") as fd:
+            fd.seek(self.offset)
+            for line in iter(fd.readline, ""):
+                self.offset += len(line)
+                self.lines += 1
+                try:
+                    parsed = replay.parseLine(line.rstrip("\r\n"))
+                except Exception:
+                    self.errors += 1
+                    continue
+                if parsed is not None and parsed[0] == replay.DIRECTION_IN:
+                    yield parsed[1]
+
+    def _feed(self, packet):
+        """handle one incoming packet, returns the hand_serial if a hand started"""
+        self.packets += 1
+        try:
+            self.protocol.handlePacket(packet)
+        except Exception:
+            # the log goes on, so does the replay
+            self.errors += 1
+        if packet.type == networkpackets.PACKET_POKER_START:
+            self._handStarted(packet.hand_serial)
+            return packet.hand_serial
+        return None
+
+    def _handStarted(self, hand_serial):
+        self.hand_serial = hand_serial
+        self.hands.setdefault(hand_serial, self.offset)
+        if self.snapshot_every is None:
+            return
+        self._hands_since_snapshot += 1
+        if self._hands_since_snapshot >= self.snapshot_every and \
+                (not self._snapshot_offsets or self._snapshot_offsets[-1] < self.offset):
+            self.snapshots.append(Snapshot(self.offset, hand_serial, self.protocol))
+            self._snapshot_offsets.append(self.offset)
+            self._hands_since_snapshot = 0
+
+    def run(self, until_hand=None):
+        """replay the rest of the log or until the hand started, returns True if the hand was found"""
+        for packet in self._iterPackets():
+            if self._feed(packet) == until_hand and until_hand is not None:
+                return True
+        return False
+
+    def seek(self, hand_serial):
+        """restore the state right after the PacketPokerStart of the hand, raises KeyError if it is not in the log"""
+        if hand_serial not in self.hands:
+            if not self.run(until_hand=hand_serial):
+                raise KeyError(hand_serial)
+            return
+        target = self.hands[hand_serial]
+        index = bisect.bisect_right(self._snapshot_offsets, target) - 1
+        snapshot = self.snapshots[index] if index >= 0 else None
+        if self.offset > target or (snapshot is not None and snapshot.offset > self.offset):
+            # the nearest snapshot is closer than the current position (or we are behind the hand)
+            if snapshot is not None:
+                self._restore(snapshot)
+            else:
+                self._rewind()
+        if self.offset < target:
+            self.run(until_hand=hand_serial)
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="replay a packet log without a server")
+    parser.add_argument("logfile")
+    parser.add_argument("--hand", type=int, help="show the table at the start of this hand")
+    parser.add_argument("--snapshot-every", type=int, default=50, help="hands between two snapshots")
+    args = parser.parse_args(argv)
+
+    engine = ReplayEngine(args.logfile, snapshot_every=args.snapshot_every)
+    start = time.time()
+    engine.run()
+    elapsed = max(time.time() - start, 1e-9)
+    print "%d lines/records, %d packets, %d hands, %d snapshots, %d errors in %.2fs (%.0f packets/s)" % (
+        engine.lines, engine.packets, len(engine.hands), len(engine.snapshots), engine.errors,
+        elapsed, engine.packets / elapsed)
+    if args.hand is not None:
+        start = time.time()
+        try:
+            engine.seek(args.hand)
+        except KeyError:
+            print "hand %d is not in the log" % args.hand
+            return 1
+        print "seek to hand %d in %.3fs" % (args.hand, time.time() - start)
+        for line in engine.protocol.getDebugLines():
+            print line
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
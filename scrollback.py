@@ -0,0 +1,53 @@
+"""
+bounded line history for the screen
+
+The newest lines are kept in a ring buffer of fixed size, every line that drops
+out of it is appended to a spill file. Searching streams over the spill file
+and the ring buffer, it never loads the whole history into memory.
+"""
+import collections
+import itertools
+
+
+class Scrollback(object):
+    """keeps the last maxlen lines in memory and appends older ones to the spill file"""
+
+    def __init__(self, spillfn, maxlen=5000):
+        self.spillfn = spillfn
+        self.maxlen = maxlen
+        self.spilled = 0
+        self._lines = collections.deque(maxlen=maxlen)
+        self._spill_fd = open(spillfn, "w")
+
+    def __len__(self):
+        """returns the number of lines in memory"""
+        return len(self._lines)
+
+    def append(self, line):
+        """add a line, the oldest line in memory is spilled if the buffer is full"""
+        if len(self._lines) == self.maxlen:
+            self._spill_fd.write(self._lines[0] + '\n')
+            self.spilled += 1
+        self._lines.append(line)
+
+    def visible(self, height, offset=0):
+        """returns up to height lines (oldest first) that end offset lines before the newest line"""
+        lines = list(itertools.islice(reversed(self._lines), offset, offset + height))
+        lines.reverse()
+        return lines
+
+    def iterLines(self):
+        """yields (line number, line) of the whole history, starting with the spill file"""
+        # take the state of now, lines added while iterating are not part of the result
+        spilled = self.spilled
+        lines = list(self._lines)
+        self._spill_fd.flush()
+        with open(self.spillfn) as fd:
+            for lineno, line in enumerate(itertools.islice(fd, spilled), 1):
+                yield lineno, line.rstrip('\n')
+        for lineno, line in enumerate(lines, spilled + 1):
+            yield lineno, line
+
+    def close(self):
+        """close the spill file"""
+        self._spill_fd.close()
@@ -0,0 +1,230 @@
+"""
+runs the bots of pokerbot.py in several worker processes
+
+The range of bot serials is split into one shard per worker. Every worker is a
+pokerbot.py process of its own (a forked process would share the reactor of the
+supervisor) that writes its counters as a json line to the status pipe every few
+seconds. Workers that exit or stop reporting are started again, the counters of
+all workers are summed up in a summary (and so are their latency histograms, see
+latency.py).
+"""
+import os, sys, time, signal
+import simplejson
+from twisted.internet import reactor, protocol, task
+
+from latency import LatencyTracker, writeReport
+
+# fd of the status pipe in the worker processes
+STATUS_FD = 3
+# counters every worker reports
+COUNTERS = ("hands", "actions", "errors")
+
+
+def shards(first_serial, count, workers):
+    """returns [(first_serial, bots)] of every worker, the bots are spread as evenly as possible"""
+    result = []
+    for worker in range(workers):
+        bots = count // workers + (worker < count % workers)
+        if bots:
+            result.append((first_serial, bots))
+        first_serial += bots
+    return result
+
+
+class WorkerProcess(protocol.ProcessProtocol):
+    """one worker as seen by the supervisor"""
+
+    def __init__(self, supervisor, worker_id, first_serial, bots):
+        self.supervisor = supervisor
+        self.worker_id = worker_id
+        self.first_serial = first_serial
+        self.bots = bots
+        self.pid = None
+        self.started = None
+        self.last_report = None
+        self.status = {}
+        self.restarts = 0
+        self.exit_reason = None
+        self._buffer = ""
+
+    def connectionMade(self):
+        self.pid = self.transport.pid
+        self.started = self.last_report = time.time()
+        self.status = {}
+        self._buffer = ""
+
+    def childDataReceived(self, fd, data):
+        if fd != STATUS_FD:
+            return
+        self._buffer += data
+        lines = self._buffer.split("\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            try:
+                self.status = simplejson.loads(line)
+            except ValueError:
+                continue
+            self.last_report = time.time()
+
+    def processEnded(self, reason):
+        self.supervisor.workerEnded(self, reason)
+
+    def isRunning(self):
+        return self.pid is not None
+
+    def health(self, now, stall_timeout):
+        if not self.isRunning():
+            return "restarting"
+        if now - self.last_report > stall_timeout:
+            return "stalled"
+        return "ok"
+
+
+class Supervisor(object):
+    """starts the workers, restarts them and sums up their counters"""
+
+    # seconds before a worker is started again, doubled (up to max_restart_delay) while it keeps crashing early
+    restart_delay = 1.0
+    max_restart_delay = 60.0
+    # a worker that ran shorter than this crashed early
+    min_uptime = 30.0
+
+    def __init__(self, worker_args, first_serial, bots, workers, status_interval=5.0, summary_interval=30.0,
+                 latency=False, latency_report=None):
+        # arguments of pokerbot.py every worker gets, besides its shard and the status pipe
+        self.worker_args = worker_args
+        self.status_interval = status_interval
+        self.summary_interval = summary_interval
+        self.stall_timeout = 3 * status_interval
+        self.workers = [WorkerProcess(self, worker_id, first, count)
+                        for worker_id, (first, count) in enumerate(shards(first_serial, bots, workers))]
+        # counters of the workers that ended, their processes do not report them anymore
+        self.finished = dict.fromkeys(COUNTERS, 0)
+        self.finished_latency = LatencyTracker()
+        self.latency = latency
+        self.latency_report = latency_report
+        self.started = time.time()
+        self._delays = {}
+        self._stopping = False
+        self._summary_call = None
+
+    def start(self):
+        for worker in self.workers:
+            self.spawn(worker)
+        self._summary_call = task.LoopingCall(self.printSummary)
+        self._summary_call.start(self.summary_interval, now=False)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+
+    def spawn(self, worker):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pokerbot.py")
+        args = [sys.executable, script,
+                "--first-serial", str(worker.first_serial), "--bots", str(worker.bots),
+                "--status-fd", str(STATUS_FD), "--status-interval", str(self.status_interval)] + self.worker_args
+        reactor.spawnProcess(worker, sys.executable, args,
+            env=os.environ, childFDs={0: "w", 1: 1, 2: 2, STATUS_FD: "r"})
+
+    def workerEnded(self, worker, reason):
+        for name in COUNTERS:
+            self.finished[name] += worker.status.get(name, 0)
+        if "latency" in worker.status:
+            self.finished_latency.merge(LatencyTracker.fromDict(worker.status["latency"]))
+        uptime = time.time() - worker.started if worker.started else 0
+        worker.pid = None
+        worker.status = {}
+        worker.exit_reason = reason.getErrorMessage()
+        if self._stopping:
+            return
+        delay = self._delays.get(worker.worker_id, self.restart_delay)
+        self._delays[worker.worker_id] = min(delay * 2, self.max_restart_delay) if uptime < self.min_uptime else self.restart_delay
+        print "worker %d ended (%s), restart in %.0fs" % (worker.worker_id, worker.exit_reason, delay)
+        worker.restarts += 1
+        reactor.callLater(delay, self.spawn, worker)
+
+    def checkStalled(self):
+        """kill the workers that stopped reporting, they are restarted when they ended"""
+        now = time.time()
+        for worker in self.workers:
+            if worker.health(now, self.stall_timeout) == "stalled":
+                self.signal(worker, signal.SIGKILL)
+
+    def signal(self, worker, signum):
+        if worker.isRunning():
+            try:
+                worker.transport.signalProcess(signum)
+            except Exception:
+                pass
+
+    def totals(self):
+        """returns the counters summed up over all workers, ended ones included"""
+        totals = dict(self.finished)
+        for worker in self.workers:
+            for name in COUNTERS:
+                totals[name] += worker.status.get(name, 0)
+        return totals
+
+    def totalLatency(self):
+        """returns a LatencyTracker with the histograms of all workers"""
+        total = LatencyTracker()
+        total.merge(self.finished_latency)
+        for worker in self.workers:
+            if "latency" in worker.status:
+                total.merge(LatencyTracker.fromDict(worker.status["latency"]))
+        return total
+
+    def summary(self):
+        """returns the lines of the summary"""
+        now = time.time()
+        lines = ["%6s %7s %11s %10s %9s %8s %8s %7s %8s" % (
+            "worker", "pid", "serials", "health", "connected", "hands", "actions", "errors", "restarts")]
+        for worker in self.workers:
+            status = worker.status
+            lines.append("%6d %7s %5d-%-5d %10s %5d/%-3d %8d %8d %7d %8d" % (
+                worker.worker_id, worker.pid or "-", worker.first_serial, worker.first_serial + worker.bots - 1,
+                worker.health(now, self.stall_timeout), status.get("connected", 0), worker.bots,
+                status.get("hands", 0), status.get("actions", 0), status.get("errors", 0), worker.restarts))
+        totals = self.totals()
+        lines.append("total: %(hands)d hands, %(actions)d actions, %(errors)d errors" % totals)
+        if self.latency:
+            lines.extend(self.totalLatency().report(now - self.started))
+        return lines
+
+    def printSummary(self):
+        self.checkStalled()
+        for line in self.summary():
+            print line
+        sys.stdout.flush()
+
+    def stop(self):
+        if self._stopping:
+            return
+        self._stopping = True
+        if self._summary_call is not None and self._summary_call.running:
+            self._summary_call.stop()
+        for worker in self.workers:
+            self.signal(worker, signal.SIGTERM)
+        self.printSummary()
+        if self.latency and self.latency_report:
+            writeReport(self.latency_report, self.totalLatency(), time.time() - self.started)
+
+
+class StatusReporter(object):
+    """worker side: writes the counters to the status pipe of the supervisor"""
+
+    def __init__(self, fd, counters, interval, latency=None):
+        self.fd = fd
+        self.counters = counters
+        self.latency = latency
+        self._call = task.LoopingCall(self.report)
+        self._call.start(interval)
+
+    def report(self):
+        status = dict(self.counters, pid=os.getpid(), time=time.time())
+        if self.latency is not None:
+            self.latency.expire()
+            status["latency"] = self.latency.toDict()
+        try:
+            os.write(self.fd, simplejson.dumps(status) + "\n")
+        except OSError:
+            # the supervisor is gone
+            self._call.stop()
+            reactor.stop()